@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Book, Category, Review
+from .models import Book, Category, FeaturedBook, Review
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -23,3 +23,9 @@ class ReviewAdmin(admin.ModelAdmin):
     search_fields = ('book__title', 'user__username', 'comment')
     date_hierarchy = 'created_at'
     ordering = ('-created_at',)
+
+@admin.register(FeaturedBook)
+class FeaturedBookAdmin(admin.ModelAdmin):
+    list_display = ('position', 'book', 'reason')
+    list_filter = ('reason',)
+    raw_id_fields = ('book',)
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class BooksConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'books'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .autocomplete import PRELOAD, preload
+
+        if PRELOAD:
+            preload()
@@ -0,0 +1,394 @@
+import gzip
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Book
+from .search.analysis import normalize
+from .versions import get_version
+
+# A prefix matching more keys than this is too slow to rank on every
+# keystroke; its best completions are kept precomputed. Shorter ranges
+# are ranked by scanning them.
+SCAN_LIMIT = 256
+MAX_COMPLETIONS = 20
+DEFAULT_COMPLETIONS = 8
+# Precomputed lists keep spare entries so removals rarely re-rank
+TOP_SIZE = MAX_COMPLETIONS * 2
+# Written by build_autocomplete_snapshot and read at process start;
+# without one the index is built from the database.
+SNAPSHOT_PATH = getattr(settings, 'BOOKS_AUTOCOMPLETE_SNAPSHOT', None)
+# Load the index in a background thread when the app starts instead of on
+# the first request. Off by default so management commands and test runs
+# don't read the catalog.
+PRELOAD = getattr(settings, 'BOOKS_AUTOCOMPLETE_PRELOAD', False)
+# How often a process catches up with books changed by other processes,
+# in seconds; it only queries when the catalog or ratings version moved.
+SYNC_INTERVAL = getattr(settings, 'BOOKS_AUTOCOMPLETE_SYNC_INTERVAL', 30)
+# updated_at is stamped before commit, so a catch-up looks back this far
+SYNC_MARGIN = timedelta(minutes=1)
+
+SNAPSHOT_FIELDS = ['pk', 'title', 'slug', 'author', 'total_reviews', 'rating']
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_prefix(text):
+    return ' '.join(normalize(text).split())
+
+
+class PrefixIndex:
+    """
+    In-memory title and author completions: a sorted array of
+    ``(key, entry id)`` searched with bisect, plus the precomputed best
+    completions of every prefix matching more than SCAN_LIMIT keys.
+    Titles rank by (total_reviews, rating); an author ranks by their best
+    book.
+
+    A precomputed list holds the exact best entries of its prefix, at
+    least MAX_COMPLETIONS of them unless the prefix has fewer matches.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.entries = {}
+        self.top = {}
+        self.books = {}
+        self.author_books = {}
+        self.lock = threading.Lock()
+        # Catch-up state for changes made by other processes
+        self.version = None
+        self.synced_at = None
+        self.checked_at = time.monotonic()
+        self.sync_lock = threading.Lock()
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build from ``SNAPSHOT_FIELDS`` rows in one pass."""
+        index = cls()
+        for pk, title, slug, author, total_reviews, rating in rows:
+            index.books[pk] = (title, slug, author, (total_reviews, float(rating)))
+            author_key = normalize_prefix(author)
+            if author_key:
+                index.author_books.setdefault(author_key, {})[pk] = (total_reviews, float(rating))
+            title_key = normalize_prefix(title)
+            if title_key:
+                index.entries[('title', pk)] = (title_key, title, 'title', (total_reviews, float(rating)), slug)
+        for pk, (title, slug, author, score) in index.books.items():
+            author_key = normalize_prefix(author)
+            if author_key and ('author', author_key) not in index.entries:
+                index.entries[('author', author_key)] = index._author_entry(author_key, author)
+
+        index.keys = sorted((entry[0], entry_id) for entry_id, entry in index.entries.items())
+        for child, start, end in index._children('', 0, len(index.keys)):
+            if child and end - start > SCAN_LIMIT:
+                index._build(child, start, end)
+        return index
+
+    def _score(self, entry_id):
+        return self.entries[entry_id][3]
+
+    def _author_entry(self, author_key, label):
+        score = max(self.author_books[author_key].values())
+        return (author_key, label, 'author', score, None)
+
+    def _bounds(self, prefix):
+        return (
+            bisect_left(self.keys, (prefix,)),
+            bisect_left(self.keys, (prefix + '\uffff',)),
+        )
+
+    def _children(self, prefix, start, end):
+        """
+        Split the keys in ``start:end``, which all start with ``prefix``,
+        by their next character: yields ``(child prefix, start, end)``,
+        with None for the keys equal to ``prefix``.
+        """
+        depth = len(prefix) + 1
+        while start < end:
+            key = self.keys[start][0]
+            if len(key) < depth:
+                yield None, start, start + 1
+                start += 1
+                continue
+            child = key[:depth]
+            child_end = bisect_left(self.keys, (child + '\uffff',), start, end)
+            yield child, start, child_end
+            start = child_end
+
+    def _merge(self, prefix, start, end, build=False):
+        """
+        Rank ``prefix`` from its children: the precomputed lists of the
+        large ones and a scan of the rest, so at most a few SCAN_LIMITs of
+        entries are looked at. With ``build``, large children are built
+        first instead of read.
+        """
+        candidates = []
+        exact = TOP_SIZE
+        for child, child_start, child_end in self._children(prefix, start, end):
+            if child and build and child_end - child_start > SCAN_LIMIT:
+                self._build(child, child_start, child_end)
+            ranked = self.top.get(child) if child else None
+            if ranked is None:
+                candidates.extend(entry_id for key, entry_id in self.keys[child_start:child_end])
+            else:
+                candidates.extend(ranked)
+                if len(ranked) < child_end - child_start:
+                    # Only this many of the child's best are known
+                    exact = min(exact, len(ranked))
+        return heapq.nlargest(exact, candidates, key=self._score)
+
+    def _build(self, prefix, start, end):
+        self.top[prefix] = self._merge(prefix, start, end, build=True)
+
+    def _ranked(self, prefix, limit):
+        ranked = self.top.get(prefix)
+        if ranked is not None:
+            return ranked[:limit]
+        start, end = self._bounds(prefix)
+        # Not precomputed, so at most SCAN_LIMIT keys
+        return heapq.nlargest(limit, (self.keys[i][1] for i in range(start, end)), key=self._score)
+
+    def _add_entry(self, entry_id, entry):
+        self.entries[entry_id] = entry
+        insort(self.keys, (entry[0], entry_id))
+        score = entry[3]
+        for length in range(1, len(entry[0]) + 1):
+            prefix = entry[0][:length]
+            start, end = self._bounds(prefix)
+            ranked = self.top.get(prefix)
+            if ranked is None:
+                if end - start <= SCAN_LIMIT:
+                    # Longer prefixes match fewer keys still
+                    break
+                self.top[prefix] = self._merge(prefix, start, end)
+            elif len(ranked) == end - start - 1 or score > self._score(ranked[-1]):
+                ranked.append(entry_id)
+                ranked.sort(key=self._score, reverse=True)
+                del ranked[TOP_SIZE:]
+
+    def _remove_entry(self, entry_id):
+        entry = self.entries.get(entry_id)
+        if entry is None:
+            return
+        position = bisect_left(self.keys, (entry[0], entry_id))
+        if position < len(self.keys) and self.keys[position] == (entry[0], entry_id):
+            del self.keys[position]
+        # Longest first, so a re-ranked prefix reads repaired children
+        for length in range(len(entry[0]), 0, -1):
+            prefix = entry[0][:length]
+            ranked = self.top.get(prefix)
+            if ranked is None or entry_id not in ranked:
+                continue
+            ranked.remove(entry_id)
+            start, end = self._bounds(prefix)
+            if len(ranked) < min(MAX_COMPLETIONS, end - start):
+                self.top[prefix] = self._merge(prefix, start, end)
+        del self.entries[entry_id]
+
+    def _refresh_author(self, author_key, label):
+        self._remove_entry(('author', author_key))
+        if self.author_books.get(author_key):
+            self._add_entry(('author', author_key), self._author_entry(author_key, label))
+        else:
+            self.author_books.pop(author_key, None)
+
+    def _remove_book(self, pk):
+        book = self.books.pop(pk, None)
+        if book is None:
+            return
+        title, slug, author, score = book
+        self._remove_entry(('title', pk))
+        author_key = normalize_prefix(author)
+        if author_key:
+            self.author_books.get(author_key, {}).pop(pk, None)
+            self._refresh_author(author_key, author)
+
+    def remove_book(self, pk):
+        with self.lock:
+            self._remove_book(pk)
+
+    def update_book(self, book):
+        score = (book.total_reviews, float(book.rating))
+        with self.lock:
+            self._remove_book(book.pk)
+            self.books[book.pk] = (book.title, book.slug, book.author, score)
+            title_key = normalize_prefix(book.title)
+            if title_key:
+                self._add_entry(('title', book.pk), (title_key, book.title, 'title', score, book.slug))
+            author_key = normalize_prefix(book.author)
+            if author_key:
+                self.author_books.setdefault(author_key, {})[book.pk] = score
+                self._refresh_author(author_key, book.author)
+
+    def complete(self, prefix, limit=DEFAULT_COMPLETIONS):
+        prefix = normalize_prefix(prefix)
+        if not prefix:
+            return []
+        limit = min(limit, MAX_COMPLETIONS)
+        with self.lock:
+            entries = [self.entries[entry_id] for entry_id in self._ranked(prefix, limit)]
+        return [
+            {'text': label, 'kind': kind, 'slug': slug}
+            for key, label, kind, score, slug in entries
+        ]
+
+
+def book_rows(books):
+    return books.order_by().values_list(*SNAPSHOT_FIELDS).iterator(chunk_size=5000)
+
+
+def write_snapshot(path, rows, taken_at):
+    tmp_path = f'{path}.tmp'
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        json.dump({'taken_at': taken_at.isoformat(), 'rows': rows}, f, separators=(',', ':'), default=str)
+    os.replace(tmp_path, path)
+
+
+def build_snapshot(path):
+    """Write every book's completion data to ``path``; returns the number of books."""
+    taken_at = timezone.now()
+    rows = [list(row) for row in book_rows(Book.objects.all())]
+    write_snapshot(path, rows, taken_at)
+    return len(rows)
+
+
+def refresh_books(index, book_ids):
+    """Re-read ``book_ids`` into ``index``, dropping those that are gone."""
+    book_ids = list(book_ids)
+    for start in range(0, len(book_ids), 500):
+        batch = book_ids[start:start + 500]
+        books = Book.objects.filter(pk__in=batch).only('title', 'slug', 'author', 'total_reviews', 'rating')
+        found = set()
+        for book in books:
+            index.update_book(book)
+            found.add(book.pk)
+        for pk in batch:
+            if pk not in found:
+                index.remove_book(pk)
+
+
+def catalog_version():
+    # Suggestions show titles and authors and rank by ratings
+    return get_version('catalog'), get_version('ratings')
+
+
+def catch_up(index, since):
+    """Apply the books changed since ``since`` and drop deleted ones."""
+    changed = Book.objects.filter(updated_at__gte=since - SYNC_MARGIN).order_by()
+    for book in changed.only('title', 'slug', 'author', 'total_reviews', 'rating').iterator(chunk_size=5000):
+        index.update_book(book)
+    # A deleted book leaves no row to find: check every indexed id, a pk
+    # range at a time. Counting rows would miss a delete plus an insert.
+    with index.lock:
+        book_ids = sorted(index.books)
+    for start in range(0, len(book_ids), 5000):
+        batch = book_ids[start:start + 5000]
+        existing = set(Book.objects.filter(pk__range=(batch[0], batch[-1])).values_list('pk', flat=True))
+        for pk in batch:
+            if pk not in existing:
+                index.remove_book(pk)
+
+
+def load_index(path=SNAPSHOT_PATH):
+    """
+    Load the index from the snapshot at ``path`` and catch up with books
+    changed since it was taken, or build it from the database if there is
+    no snapshot.
+    """
+    version = catalog_version()
+    if path and os.path.exists(path):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            snapshot = json.load(f)
+        index = PrefixIndex.from_rows(snapshot['rows'])
+        started = timezone.now()
+        catch_up(index, parse_datetime(snapshot['taken_at']))
+    else:
+        started = timezone.now()
+        index = PrefixIndex.from_rows(book_rows(Book.objects.all()))
+    index.version = version
+    index.synced_at = started
+    return index
+
+
+def _sync(index):
+    # Runs in its own thread, holding index.sync_lock
+    try:
+        version = catalog_version()
+        if version == index.version:
+            return
+        started = timezone.now()
+        catch_up(index, index.synced_at)
+        index.version = version
+        index.synced_at = started
+    except DatabaseError:
+        logger.exception('Could not sync the autocomplete index')
+    finally:
+        index.sync_lock.release()
+        connection.close()
+
+
+def _load():
+    try:
+        get_index()
+    except DatabaseError:
+        logger.exception('Could not preload the autocomplete index')
+    finally:
+        connection.close()
+
+
+def preload():
+    """Load the index in a background thread."""
+    threading.Thread(target=_load, name='autocomplete-preload', daemon=True).start()
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """
+    The process's index, loaded on first use unless preloaded. Every
+    SYNC_INTERVAL a background thread catches it up with changes made by
+    other processes; requests keep reading the index meanwhile.
+    """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = load_index()
+    index = _index
+    if time.monotonic() - index.checked_at >= SYNC_INTERVAL and index.sync_lock.acquire(blocking=False):
+        index.checked_at = time.monotonic()
+        threading.Thread(target=_sync, args=(index,), name='autocomplete-sync', daemon=True).start()
+    return index
+
+
+def loaded_index():
+    """The index if this process has loaded it, for signal handlers."""
+    return _index
+
+
+def _after_fork():
+    # Another thread may have held the locks when the process forked
+    global _index_lock
+    _index_lock = threading.Lock()
+    if _index is not None:
+        _index.lock = threading.Lock()
+        _index.sync_lock = threading.Lock()
+    elif PRELOAD:
+        preload()
+
+
+if hasattr(os, 'register_at_fork'):  # not on Windows
+    os.register_at_fork(after_in_child=_after_fork)
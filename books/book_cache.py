@@ -0,0 +1,161 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404
+
+from .metrics import CACHE_REQUESTS
+from .models import Book
+
+LOCAL_SIZE = getattr(settings, 'BOOKS_SLUG_CACHE_SIZE', 1024)
+# Entries in the per-process tier are not invalidated in other worker
+# processes, so keep their lifetime short.
+LOCAL_TTL = getattr(settings, 'BOOKS_SLUG_CACHE_LOCAL_TTL', 5)
+SHARED_TIMEOUT = getattr(settings, 'BOOKS_SLUG_CACHE_TIMEOUT', 300)
+# How long a process may hold the shared rebuild lock for one slug
+LOCK_TIMEOUT = 10
+LOCK_WAIT = 0.05
+LOCK_RETRIES = 20
+
+# Metric labels for the per-process stats
+CACHE_RESULTS = {'local_hits': 'local_hit', 'shared_hits': 'shared_hit', 'misses': 'miss'}
+
+
+class BookCache:
+    """
+    Two-tier read-through cache of Books keyed by slug: a per-process LRU
+    with a TTL in front of the Django cache backend.
+
+    A miss is loaded from the database by one thread per process (the
+    others wait for it) and, across processes, by whoever wins a
+    ``cache.add`` lock; the rest poll the shared tier briefly before giving
+    up and querying themselves. Callers always get their own copy of the
+    Book, so mutating it cannot leak into the cache.
+    """
+
+    def __init__(self, size=LOCAL_SIZE, ttl=LOCAL_TTL, timeout=SHARED_TIMEOUT):
+        self.size = size
+        self.ttl = ttl
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading = {}
+        self._stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0}
+
+    def _key(self, slug):
+        return f'books:book:{slug}'
+
+    def _count(self, stat):
+        with self._lock:
+            self._stats[stat] += 1
+        CACHE_REQUESTS.inc(cache='book', result=CACHE_RESULTS[stat])
+
+    def _get_local(self, slug):
+        with self._lock:
+            entry = self._entries.get(slug)
+            if entry is None:
+                return None
+            expires, book = entry
+            if expires < time.monotonic():
+                del self._entries[slug]
+                return None
+            self._entries.move_to_end(slug)
+            return book
+
+    def _set_local(self, slug, book):
+        with self._lock:
+            self._entries[slug] = (time.monotonic() + self.ttl, book)
+            self._entries.move_to_end(slug)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def _load(self, slug, updated_at=None):
+        key = self._key(slug)
+        lock_key = f'{key}:lock'
+        locked = cache.add(lock_key, 1, LOCK_TIMEOUT)
+        if not locked:
+            # Another process is already loading this slug
+            for _ in range(LOCK_RETRIES):
+                time.sleep(LOCK_WAIT)
+                book = cache.get(key)
+                if self._fresh(book, updated_at):
+                    return book
+        try:
+            # The category is cached with the book; the detail page shows it
+            book = Book.objects.select_related('category').filter(slug=slug).first()
+            if book is not None:
+                cache.set(key, book, self.timeout)
+            return book
+        finally:
+            if locked:
+                cache.delete(lock_key)
+
+    def _fresh(self, book, updated_at):
+        return book is not None and (updated_at is None or book.updated_at >= updated_at)
+
+    def get(self, slug, updated_at=None):
+        """
+        Return a copy of the Book with ``slug``, or None. A cached copy
+        older than ``updated_at``, when given, is loaded again.
+        """
+        book = self._get_local(slug)
+        if self._fresh(book, updated_at):
+            self._count('local_hits')
+            return copy.copy(book)
+
+        with self._lock:
+            loading = self._loading.setdefault(slug, threading.Lock())
+        with loading:
+            # A concurrent caller may have filled the entry while we waited
+            book = self._get_local(slug)
+            if self._fresh(book, updated_at):
+                self._count('local_hits')
+                return copy.copy(book)
+            book = cache.get(self._key(slug))
+            if self._fresh(book, updated_at):
+                self._count('shared_hits')
+            else:
+                self._count('misses')
+                book = self._load(slug, updated_at)
+            if book is not None:
+                self._set_local(slug, book)
+        with self._lock:
+            self._loading.pop(slug, None)
+        return copy.copy(book) if book is not None else None
+
+    def invalidate(self, slug):
+        with self._lock:
+            self._entries.pop(slug, None)
+        cache.delete(self._key(slug))
+
+    def invalidate_many(self, slugs):
+        slugs = list(slugs)
+        with self._lock:
+            for slug in slugs:
+                self._entries.pop(slug, None)
+        cache.delete_many([self._key(slug) for slug in slugs])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Hit/miss counters for this process."""
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = sum(stats.values())
+        stats['hit_rate'] = (stats['local_hits'] + stats['shared_hits']) / lookups if lookups else 0.0
+        return stats
+
+
+book_cache = BookCache()
+
+
+def get_book_or_404(slug, updated_at=None):
+    book = book_cache.get(slug, updated_at)
+    if book is None:
+        raise Http404('No Book matches the given query.')
+    return book
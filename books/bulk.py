@@ -0,0 +1,48 @@
+from contextlib import contextmanager
+
+from django.db import connections, models
+
+
+@contextmanager
+def keep_timestamps(model, *field_names):
+    """
+    Let bulk_create() store the given auto_now_add fields as set on the
+    instances instead of stamping every row with now(). Not thread-safe;
+    meant for management commands.
+    """
+    fields = [model._meta.get_field(name) for name in field_names]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def raw_delete(queryset):
+    """
+    Delete ``queryset`` and, first, every row that cascades from it, with
+    one DELETE per table instead of the ORM collector: no rows are loaded
+    and no signals are sent, so callers must invalidate caches themselves.
+    SET_NULL relations are cleared with one UPDATE; any other on_delete is
+    left to the database to enforce. Returns the number of rows deleted
+    from ``queryset``'s own table.
+    """
+    model = queryset.model
+    for relation in model._meta.get_fields(include_hidden=True):
+        if not (relation.one_to_many or relation.one_to_one) or not relation.auto_created or relation.concrete:
+            continue
+        related = relation.related_model._base_manager.filter(**{f'{relation.field.name}__in': queryset})
+        if relation.on_delete is models.CASCADE:
+            raw_delete(related)
+        elif relation.on_delete is models.SET_NULL:
+            related.update(**{relation.field.name: None})
+    # The extra derived table lets MySQL select from the table it deletes from
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    connection = connections[queryset.db]
+    table = connection.ops.quote_name(model._meta.db_table)
+    pk = connection.ops.quote_name(model._meta.pk.column)
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table} WHERE {pk} IN (SELECT * FROM ({sql}) doomed)', params)
+        return cursor.rowcount
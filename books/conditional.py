@@ -0,0 +1,100 @@
+import hashlib
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+
+from .dashboard import dashboard_version
+from .models import Book
+from .reviews import review_version
+from .versions import get_version
+
+# How long browsers and shared caches (reverse proxy, CDN) may keep a page
+# that is the same for every anonymous visitor
+PROXY_MAX_AGE = getattr(settings, 'BOOKS_PROXY_MAX_AGE', 60)
+
+
+def _etag(*parts):
+    return hashlib.md5(':'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+def _params(request):
+    """Query string with its parameters sorted, so equivalent URLs share an ETag."""
+    return urlencode(sorted((name, value) for name, values in request.GET.lists() for value in values))
+
+
+def _user_state(request):
+    # Pending flash messages are rendered into the page, so a request
+    # carrying one must not get a 304.
+    messages = len(get_messages(request))
+    if request.user.is_authenticated:
+        return f'user-{request.user.pk}-{dashboard_version(request.user.pk)}-{messages}'
+    return f'anonymous-{messages}'
+
+
+def home_etag(request):
+    return _etag('home', get_version('catalog'), _user_state(request))
+
+
+def book_list_etag(request):
+    return _etag(
+        'book_list', get_version('catalog'), get_version('ratings'), _params(request), _user_state(request),
+    )
+
+
+def book_detail_etag(request, slug):
+    # Read from the table, not book_cache: its per-process copies can be a
+    # few seconds old, and another worker would answer 304 for a changed
+    # book. Every write to a Book sets updated_at.
+    book = Book.objects.filter(slug=slug).values_list('pk', 'updated_at').first()
+    if book is None:
+        return None
+    pk, updated_at = book
+    # The view renders a copy at least this fresh, so body and tag agree
+    request.book_updated_at = updated_at
+    return _etag(
+        'book_detail', pk, updated_at.isoformat(), review_version(pk), _params(request), _user_state(request),
+    )
+
+
+def _shareable(request, response, had_messages):
+    """
+    Whether ``response`` is the same for every anonymous visitor: no
+    session or login, no flash messages and no CSRF token rendered into it.
+    """
+    if request.user.is_authenticated or settings.SESSION_COOKIE_NAME in request.COOKIES:
+        return False
+    # get_token() marks the request when a template renders {% csrf_token %}
+    return not (had_messages or request.META.get('CSRF_COOKIE_NEEDS_UPDATE') or response.cookies)
+
+
+def conditional_page(etag_func):
+    """
+    Answer GET requests whose If-None-Match matches ``etag_func`` with a
+    304 before the view runs, and mark the response cacheable: by shared
+    caches when it is the same for every anonymous visitor, otherwise by
+    the browser only, and always revalidated.
+
+    The ETag functions read versions from the cache (and book_detail one
+    indexed row), so a 304 costs no rendering.
+    """
+    def decorator(view):
+        conditional_view = condition(etag_func=etag_func)(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            # Rendering the page consumes the messages
+            had_messages = len(get_messages(request)) > 0
+            response = conditional_view(request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                if _shareable(request, response, had_messages):
+                    patch_cache_control(response, public=True, max_age=PROXY_MAX_AGE)
+                else:
+                    patch_cache_control(response, private=True, no_cache=True)
+                patch_vary_headers(response, ['Cookie'])
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,115 @@
+import hashlib
+import io
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageDraw
+
+# Variant widths in pixels; heights follow the cover's aspect ratio
+VARIANTS = {
+    'thumbnail': 160,
+    'card': 320,
+    'detail': 640,
+}
+
+FORMATS = {
+    'webp': ('webp', 'WEBP', {'quality': 80, 'method': 6}),
+    'jpeg': ('jpg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+VARIANT_DIR = 'book_covers/variants'
+PLACEHOLDER_DIR = 'book_covers/placeholders'
+
+PLACEHOLDER_COLORS = [
+    (124, 58, 237), (37, 99, 235), (5, 150, 105), (217, 119, 6), (220, 38, 38), (71, 85, 105),
+    (190, 24, 93), (13, 148, 136), (101, 163, 13), (202, 138, 4), (30, 64, 175), (120, 53, 15),
+]
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def variant_name(cover_hash, variant, image_format):
+    """
+    Storage name of one variant. Names are derived from the source image
+    content, so identical covers share files and a URL never changes
+    meaning: variants can be served with a far-future Cache-Control.
+    """
+    extension = FORMATS[image_format][0]
+    return f'{VARIANT_DIR}/{cover_hash[:2]}/{cover_hash}-{VARIANTS[variant]}.{extension}'
+
+
+def generate_variants(data, storage=default_storage):
+    """
+    Write every variant of the cover image ``data`` that does not exist
+    yet and return ``(cover_hash, number of files written)``.
+    """
+    cover_hash = content_hash(data)
+    missing = [
+        (variant, image_format)
+        for variant in VARIANTS
+        for image_format in FORMATS
+        if not storage.exists(variant_name(cover_hash, variant, image_format))
+    ]
+    if not missing:
+        return cover_hash, 0
+
+    with Image.open(io.BytesIO(data)) as source:
+        source.load()
+        image = source.convert('RGB')
+    for variant, image_format in missing:
+        width = VARIANTS[variant]
+        resized = image
+        if image.width > width:
+            height = round(image.height * width / image.width)
+            resized = image.resize((width, height), Image.LANCZOS)
+        extension, pil_format, save_options = FORMATS[image_format]
+        buffer = io.BytesIO()
+        resized.save(buffer, pil_format, **save_options)
+        storage.save(variant_name(cover_hash, variant, image_format), ContentFile(buffer.getvalue()))
+    return cover_hash, len(missing)
+
+
+def cover_url(book, variant='card', image_format='jpeg'):
+    """URL of a cover variant, falling back to the original upload."""
+    if book.cover_hash:
+        return default_storage.url(variant_name(book.cover_hash, variant, image_format))
+    if book.cover_image:
+        return book.cover_image.url
+    return ''
+
+
+def cover_srcset(book, image_format='jpeg'):
+    if not book.cover_hash:
+        return ''
+    return ', '.join(
+        f'{default_storage.url(variant_name(book.cover_hash, variant, image_format))} {width}w'
+        for variant, width in VARIANTS.items()
+    )
+
+
+def has_cover(name, storage=default_storage):
+    """Whether ``name`` is a stored cover image rather than a placeholder."""
+    return bool(name) and not name.startswith(f'{PLACEHOLDER_DIR}/') and storage.exists(name)
+
+
+def placeholder_cover(index, storage=default_storage):
+    """
+    Draw placeholder cover number ``index`` locally, store it once with its
+    variants and return ``(storage name, cover_hash)``.
+    """
+    name = f'{PLACEHOLDER_DIR}/placeholder-{index + 1}.jpg'
+    color = PLACEHOLDER_COLORS[index % len(PLACEHOLDER_COLORS)]
+    image = Image.new('RGB', (400, 600), color)
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((30, 30, 370, 570), outline=(255, 255, 255), width=6)
+    draw.text((60, 280), f'BookCycle #{index + 1}', fill=(255, 255, 255))
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=85)
+    data = buffer.getvalue()
+
+    if not storage.exists(name):
+        storage.save(name, ContentFile(data))
+    cover_hash, files = generate_variants(data, storage)
+    return name, cover_hash
@@ -0,0 +1,66 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from transactions.models import Transaction
+
+from .inventory import LOAN_TYPES
+from .models import Review
+from .versions import bump_version, get_version
+from .wishlists import WishlistEntry
+
+# Book details shown on the dashboard can change without the user's
+# version moving, so keep the summary short-lived.
+DASHBOARD_CACHE_TIMEOUT = getattr(settings, 'BOOKS_DASHBOARD_CACHE_TIMEOUT', 300)
+RECENT_REVIEWS = 5
+
+
+def _version_name(user_id):
+    return f'dashboard:{user_id}'
+
+
+def dashboard_version(user_id):
+    """Version bumped by any change to the user's transactions, reviews or wishlist."""
+    return get_version(_version_name(user_id))
+
+
+def invalidate_dashboard(user_id):
+    bump_version(_version_name(user_id))
+
+
+def get_dashboard(user):
+    """
+    Everything the dashboard shows for ``user``, in four queries, cached
+    under a per-user version that the user's transactions, reviews and
+    wishlist changes bump.
+    """
+    key = f'books:dashboard:{user.pk}:{dashboard_version(user.pk)}'
+    summary = cache.get(key)
+    if summary is not None:
+        return summary
+
+    # Returned loans are stored as 'return', so every borrow/rent counts
+    # as borrowed; only the ones still out are listed.
+    loans = Transaction.objects.filter(user=user, transaction_type__in=LOAN_TYPES)
+    total_borrowed = loans.count()
+    active_transactions = list(
+        loans.filter(status='completed').select_related('book__category').order_by('-created_at')
+    )
+    borrowed_books = list({loan.book_id: loan.book for loan in active_transactions}.values())
+
+    wishlist_books = [
+        entry.book
+        for entry in WishlistEntry.objects.filter(wishlist__user=user).select_related('book__category').order_by('pk')
+    ]
+    recent_reviews = list(
+        Review.objects.filter(user=user).select_related('book', 'user').order_by('-created_at')[:RECENT_REVIEWS]
+    )
+
+    summary = {
+        'active_transactions': active_transactions,
+        'borrowed_books': borrowed_books,
+        'total_borrowed': total_borrowed,
+        'wishlist_books': wishlist_books,
+        'recent_reviews': recent_reviews,
+    }
+    cache.set(key, summary, DASHBOARD_CACHE_TIMEOUT)
+    return summary
@@ -0,0 +1,122 @@
+import csv
+import datetime
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Book, BookQuerySet
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+# Output columns and the values() lookups behind them; the columns match
+# what import_catalog reads, plus the read-only ones.
+EXPORT_FIELDS = {
+    'isbn': 'isbn',
+    'slug': 'slug',
+    'title': 'title',
+    'author': 'author',
+    'category': 'category__name',
+    'description': 'description',
+    'publication_date': 'publication_date',
+    'publisher': 'publisher',
+    'pages': 'pages',
+    'language': 'language',
+    'price': 'price',
+    'rental_price': 'rental_price',
+    'quantity': 'quantity',
+    'availability_status': 'availability_status',
+    'cover_image': 'cover_image',
+    'rating': 'rating',
+    'total_reviews': 'total_reviews',
+    'rating_1': 'rating_1',
+    'rating_2': 'rating_2',
+    'rating_3': 'rating_3',
+    'rating_4': 'rating_4',
+    'rating_5': 'rating_5',
+    'created_at': 'created_at',
+    'updated_at': 'updated_at',
+}
+
+# Values accepted for the availability filter
+AVAILABILITY_CHOICES = list(BookQuerySet.AVAILABILITY_FILTERS)
+
+CHUNK_SIZE = 2000
+# Rows are joined into blocks of about this many bytes before being sent
+BLOCK_SIZE = 64 * 1024
+
+
+def parse_since(value):
+    """Parse an ISO date or datetime for ``updated_since``; naive values use the current time zone."""
+    since = parse_datetime(value)
+    if since is None:
+        date = parse_date(value)
+        if date is None:
+            raise ValueError(f'Invalid date or datetime: {value!r}')
+        since = datetime.datetime.combine(date, datetime.time.min)
+    if timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    return since
+
+
+def export_queryset(category=None, availability=None, updated_since=None):
+    # filter_catalog ignores unknown values, which would export everything
+    if availability and availability not in AVAILABILITY_CHOICES:
+        raise ValueError(
+            f"Unknown availability {availability!r}; expected one of {', '.join(AVAILABILITY_CHOICES)}"
+        )
+    books = Book.objects.filter_catalog(category=category, availability=availability)
+    if updated_since:
+        books = books.filter(updated_at__gte=updated_since)
+    return books.order_by('pk').values_list(*EXPORT_FIELDS.values())
+
+
+class _Echo:
+    """File-like object whose write() hands back what it was given, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def iter_lines(rows, fmt):
+    columns = list(EXPORT_FIELDS)
+    if fmt == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(columns)
+        for row in rows:
+            yield writer.writerow(row)
+    else:
+        encoder = DjangoJSONEncoder()
+        for row in rows:
+            yield encoder.encode(dict(zip(columns, row))) + '\n'
+
+
+def iter_export(books, fmt, compress=False, chunk_size=CHUNK_SIZE):
+    """
+    Yield the export of ``books`` (from export_queryset) as bytes blocks,
+    gzipped if ``compress``. Rows are fetched with iterator(), so memory use
+    does not grow with the size of the catalog.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    block = []
+    size = 0
+    for line in iter_lines(books.iterator(chunk_size=chunk_size), fmt):
+        block.append(line)
+        size += len(line)
+        if size >= BLOCK_SIZE:
+            data = ''.join(block).encode()
+            block = []
+            size = 0
+            if compressor:
+                data = compressor.compress(data)
+            if data:
+                yield data
+    data = ''.join(block).encode()
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
@@ -0,0 +1,77 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+
+from .metrics import CACHE_REQUESTS
+from .versions import get_version
+
+FACET_CACHE_TIMEOUT = getattr(settings, 'BOOKS_FACET_CACHE_TIMEOUT', 300)
+
+# Availability statuses folded into the buckets shown in the sidebar
+AVAILABILITY_BUCKETS = {
+    'available': 'available',
+    'borrowed': 'borrowed',
+    'rented': 'borrowed',
+}
+
+
+def _cache_key(params):
+    normalized = json.dumps(
+        {name: value for name, value in sorted(params.items()) if value},
+        sort_keys=True,
+    )
+    digest = hashlib.md5(normalized.encode('utf-8')).hexdigest()
+    return f"books:facets:{get_version('catalog')}:{digest}"
+
+
+def facet_rows(books):
+    """The grouped ``(category_id, availability_status, language, count)`` query behind the facets."""
+    return (
+        books.order_by()
+        .values_list('category_id', 'availability_status', 'language')
+        .annotate(count=Count('id'))
+    )
+
+
+def get_facet_counts(books, params):
+    """
+    Return category, availability and language counts for ``books``.
+
+    ``books`` is the filtered catalog queryset and ``params`` the filter
+    parameters that produced it; they make up the cache key together with
+    the catalog version, which is bumped whenever a Book's catalog fields
+    change.
+    """
+    key = _cache_key(params)
+    facets = cache.get(key)
+    if facets is not None:
+        CACHE_REQUESTS.inc(cache='facets', result='hit')
+        return facets
+    CACHE_REQUESTS.inc(cache='facets', result='miss')
+
+    facets = {
+        'category': {},
+        'availability': {'available': 0, 'borrowed': 0},
+        'language': {},
+        'total': 0,
+    }
+    for category_id, status, language, count in facet_rows(books):
+        facets['total'] += count
+        facets['category'][category_id] = facets['category'].get(category_id, 0) + count
+        facets['language'][language] = facets['language'].get(language, 0) + count
+        bucket = AVAILABILITY_BUCKETS.get(status)
+        if bucket:
+            facets['availability'][bucket] += count
+
+    cache.set(key, facets, FACET_CACHE_TIMEOUT)
+    return facets
+
+
+def annotate_category_counts(categories, facets):
+    categories = list(categories)
+    for category in categories:
+        category.book_count = facets['category'].get(category.pk, 0)
+    return categories
@@ -0,0 +1,81 @@
+from itertools import zip_longest
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .facets import annotate_category_counts, get_facet_counts
+from .models import Book, Category, FeaturedBook
+from .versions import bump_version, get_version
+
+FEATURED_COUNT = 8
+# Ranked candidates kept per shown slot, so the section still fills up when
+# some of them are borrowed or sold before the next refresh
+CANDIDATE_FACTOR = 4
+# Reviews a book needs before its rating can get it featured
+MIN_RATED_REVIEWS = getattr(settings, 'BOOKS_FEATURED_MIN_REVIEWS', 3)
+HOME_CACHE_TIMEOUT = getattr(settings, 'BOOKS_HOME_CACHE_TIMEOUT', 3600)
+
+
+def refresh_featured_books(count=FEATURED_COUNT * CANDIDATE_FACTOR):
+    """
+    Rebuild the FeaturedBook ranking from available books, alternating the
+    newest and the best rated ones, and return the number ranked.
+    """
+    books = Book.objects.available().values_list('pk', flat=True)
+    newest = books.order_by('-created_at', '-id')[:count]
+    top_rated = books.filter(rating_count__gte=MIN_RATED_REVIEWS).order_by('-rating', '-rating_count', '-id')[:count]
+
+    ranking = []
+    seen = set()
+    for pair in zip_longest(newest, top_rated):
+        for reason, book_id in zip(('new', 'top_rated'), pair):
+            if book_id is not None and book_id not in seen and len(ranking) < count:
+                seen.add(book_id)
+                ranking.append(FeaturedBook(book_id=book_id, position=len(ranking), reason=reason))
+
+    with transaction.atomic():
+        FeaturedBook.objects.all().delete()
+        FeaturedBook.objects.bulk_create(ranking)
+    bump_version('catalog')
+    return len(ranking)
+
+
+def get_featured_books(count=FEATURED_COUNT):
+    """The first ``count`` ranked books that are still available."""
+    featured = list(
+        Book.objects.available()
+        .filter(featured__isnull=False)
+        .select_related('category')
+        .order_by('featured__position')[:count]
+    )
+    if not featured:
+        # No ranking yet: newest available books
+        featured = list(Book.objects.available().select_related('category').order_by('-created_at', '-id')[:count])
+    return featured
+
+
+def get_home_sections():
+    """
+    Featured books and categories with their book counts for the home page,
+    cached under the catalog version, which changes to the books' catalog
+    fields, categories and the ranking bump. Review and stock updates leave
+    it alone, so ratings on the featured cards can lag by up to
+    HOME_CACHE_TIMEOUT.
+
+    The context is cached rather than the rendered fragment: the fragment
+    lives in the project's templates, and the header around it differs per
+    user.
+    """
+    key = f"books:home:{get_version('catalog')}"
+    sections = cache.get(key)
+    if sections is None:
+        sections = {
+            'featured_books': get_featured_books(),
+            'categories': annotate_category_counts(
+                Category.objects.all(),
+                get_facet_counts(Book.objects.all(), {}),
+            ),
+        }
+        cache.set(key, sections, HOME_CACHE_TIMEOUT)
+    return sections
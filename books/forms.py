@@ -1,5 +1,6 @@
 from django import forms
-from .models import Review
+from django.core.validators import MinValueValidator, RegexValidator
+from .models import Book, Review
 
 class ReviewForm(forms.ModelForm):
     class Meta:
@@ -15,4 +16,24 @@ class ReviewForm(forms.ModelForm):
                 'class': 'form-control',
                 'rows': '4',
             }),
-        } 
\ No newline at end of file
+        }
+
+
+class BookImportForm(forms.Form):
+    """Validates one row of a partner catalog feed (see import_catalog)."""
+    isbn = forms.CharField(max_length=13, validators=[
+        RegexValidator(r'^(\d{9}[\dX]|\d{13})$', 'Enter a valid ISBN-10 or ISBN-13.'),
+    ])
+    title = forms.CharField(max_length=200)
+    author = forms.CharField(max_length=200)
+    category = forms.CharField(max_length=100)
+    description = forms.CharField()
+    publication_date = forms.DateField()
+    publisher = forms.CharField(max_length=200)
+    pages = forms.IntegerField(min_value=1)
+    language = forms.CharField(max_length=50)
+    price = forms.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)])
+    rental_price = forms.DecimalField(max_digits=10, decimal_places=2, required=False, validators=[MinValueValidator(0)])
+    quantity = forms.IntegerField(min_value=0, required=False)
+    availability_status = forms.ChoiceField(choices=Book.AVAILABILITY_CHOICES, required=False)
+    cover_image = forms.CharField(max_length=100, required=False)
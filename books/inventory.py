@@ -0,0 +1,104 @@
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from transactions.models import Transaction
+
+from .metrics import INVENTORY_OPERATIONS
+from .models import Book
+from .signals import STOCK_FIELDS, notify_book_updated
+
+# Status a book takes when its last copy goes out with each transaction type
+SOLD_OUT_STATUS = {
+    'borrow': 'borrowed',
+    'rent': 'rented',
+    'purchase': 'sold',
+}
+
+LOAN_TYPES = ['borrow', 'rent']
+
+
+class OutOfStock(Exception):
+    pass
+
+
+class NoActiveLoan(Exception):
+    pass
+
+
+def reserve_copy(book, transaction_type, user, amount, due_date=None):
+    """
+    Take one copy of ``book`` out of stock and record the Transaction.
+
+    The stock check, the decrement and the availability change are a
+    single conditional UPDATE, so concurrent requests can never push the
+    quantity below zero. Raises OutOfStock when no copy was left.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        reserved = Book.objects.filter(
+            pk=book.pk,
+            availability_status='available',
+            quantity__gt=0,
+        ).update(
+            quantity=F('quantity') - 1,
+            updated_at=now,
+        )
+        if not reserved:
+            INVENTORY_OPERATIONS.inc(operation=transaction_type, outcome='out_of_stock')
+            raise OutOfStock(book.pk)
+        # The first UPDATE keeps the row locked until commit, so nobody sees
+        # it at zero copies and still available. Knowing whether the status
+        # changed spares the catalog caches on every other loan.
+        sold_out = Book.objects.filter(pk=book.pk, quantity__lte=0).update(
+            availability_status=SOLD_OUT_STATUS[transaction_type],
+        )
+        record = Transaction.objects.create(
+            transaction_type=transaction_type,
+            book=book,
+            user=user,
+            amount=amount,
+            due_date=due_date,
+            status='completed',
+        )
+    INVENTORY_OPERATIONS.inc(operation=transaction_type, outcome='success')
+    notify_book_updated(book, STOCK_FIELDS | {'availability_status'} if sold_out else STOCK_FIELDS)
+    return record
+
+
+def release_copy(book, user):
+    """
+    Close ``user``'s open loan of ``book`` and put the copy back in stock.
+
+    Raises NoActiveLoan when there is nothing to return, including when a
+    concurrent request already returned it.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        loan = Transaction.objects.filter(
+            book=book,
+            user=user,
+            transaction_type__in=LOAN_TYPES,
+            status='completed',
+        ).values_list('pk', flat=True).first()
+        returned = loan is not None and Transaction.objects.filter(
+            pk=loan,
+            transaction_type__in=LOAN_TYPES,
+        ).update(transaction_type='return', return_date=now)
+        if not returned:
+            INVENTORY_OPERATIONS.inc(operation='return', outcome='no_active_loan')
+            raise NoActiveLoan(book.pk)
+        Book.objects.filter(pk=book.pk).update(
+            quantity=F('quantity') + 1,
+            updated_at=now,
+        )
+        restocked = Book.objects.filter(pk=book.pk).exclude(availability_status='available').update(
+            availability_status='available',
+        )
+    from .dashboard import invalidate_dashboard
+
+    INVENTORY_OPERATIONS.inc(operation='return', outcome='success')
+    # The loan was closed with update(), which sends no post_save
+    invalidate_dashboard(user.pk)
+    notify_book_updated(book, STOCK_FIELDS | {'availability_status'} if restocked else STOCK_FIELDS)
+    return loan
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+from books.autocomplete import SNAPSHOT_PATH, build_snapshot
+import time
+
+class Command(BaseCommand):
+    help = 'Writes the snapshot the autocomplete index loads at process start'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=SNAPSHOT_PATH, help='Defaults to BOOKS_AUTOCOMPLETE_SNAPSHOT')
+
+    def handle(self, *args, **options):
+        if not options['output']:
+            raise CommandError('Set BOOKS_AUTOCOMPLETE_SNAPSHOT or pass --output')
+        started = time.monotonic()
+        count = build_snapshot(options['output'])
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote completions for {count} books to {options['output']} in {elapsed:.1f}s"
+        ))
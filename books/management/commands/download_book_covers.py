@@ -1,98 +1,269 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import Q
+from django.utils import timezone
+from books.covers import has_cover
+from books.metrics import COVER_DOWNLOADS, REGISTRY
 from books.models import Book
-import requests
+from books.signals import notify_books_updated
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+import json
 import os
-from django.utils.text import slugify
-from urllib.parse import quote
+import requests
+import threading
+import time
+
+DEFAULT_API_URL = 'https://www.googleapis.com/books/v1/volumes'
+
+# Image sizes from the Google Books API, in order of preference
+IMAGE_QUALITIES = ['extraLarge', 'large', 'medium', 'thumbnail']
+
+# Responses worth another attempt
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_BACKOFF = 60
+# Longest a run goes without saving its checkpoint, in seconds
+CHECKPOINT_INTERVAL = 30
+
+
+class HostRateLimiter:
+    """Spaces out requests to each host to at most ``rate`` per second."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.next_slot = {}
+        self.lock = threading.Lock()
+
+    def wait(self, url):
+        if not self.interval:
+            return
+        host = urlsplit(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class Checkpoint:
+    """
+    Highest book id below which every book has been handled, and the ids
+    of the books that failed, saved so an interrupted run can resume where
+    it stopped and the next run retries the failures.
+    """
+
+    def __init__(self, path, reset=False):
+        self.path = path
+        self.last_pk = 0
+        self.failed = set()
+        if not reset and os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.last_pk = data['last_pk']
+            self.failed = set(data.get('failed', []))
+
+    def save(self, last_pk):
+        self.last_pk = last_pk
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'last_pk': last_pk, 'failed': sorted(self.failed)}, f)
+        os.replace(tmp_path, self.path)
+
 
 class Command(BaseCommand):
     help = 'Downloads book cover images from Google Books API'
 
-    def handle(self, *args, **kwargs):
-        # Create media directory if it doesn't exist
-        media_root = settings.MEDIA_ROOT
-        covers_dir = os.path.join(media_root, 'book_covers')
-        os.makedirs(covers_dir, exist_ok=True)
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='Concurrent downloads')
+        parser.add_argument('--rate', type=float, default=5, help='Requests per second per host (0 = unlimited)')
+        parser.add_argument('--retries', type=int, default=3)
+        parser.add_argument('--backoff', type=float, default=0.5, help='Retry backoff factor in seconds')
+        parser.add_argument('--timeout', type=float, default=10)
+        parser.add_argument('--batch-size', type=int, default=100, help='Books per cover_image bulk update')
+        parser.add_argument(
+            '--api-url',
+            default=getattr(settings, 'BOOKS_COVER_API_URL', DEFAULT_API_URL),
+            help='Volumes search endpoint (point it at a stub server in tests)',
+        )
+        parser.add_argument('--checkpoint', help='Progress file (default: book_covers/.download_checkpoint.json)')
+        parser.add_argument('--reset', action='store_true', help='Start over instead of resuming')
+        parser.add_argument('--force', action='store_true', help='Download covers for books that already have one')
 
-        books = Book.objects.all()
-        success_count = 0
-        fail_count = 0
+    def handle(self, *args, **options):
+        if options['workers'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--workers and --batch-size must be positive')
 
-        for book in books:
-            try:
-                # Search for the book in Google Books API
-                search_query = quote(f"{book.title} {book.author}")
-                api_url = f"https://www.googleapis.com/books/v1/volumes?q={search_query}"
-                response = requests.get(api_url)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    
-                    if data.get('items'):
-                        # Get the first result
-                        book_data = data['items'][0]
-                        volume_info = book_data.get('volumeInfo', {})
-                        
-                        # Try to get the highest quality image available
-                        image_links = volume_info.get('imageLinks', {})
-                        image_url = None
-                        
-                        # Try different image qualities in order of preference
-                        for quality in ['extraLarge', 'large', 'medium', 'thumbnail']:
-                            if quality in image_links:
-                                image_url = image_links[quality]
-                                break
-                        
-                        if image_url:
-                            # Download the image
-                            image_response = requests.get(image_url)
-                            if image_response.status_code == 200:
-                                # Generate filename
-                                filename = f"{slugify(book.title)}.jpg"
-                                filepath = os.path.join(covers_dir, filename)
-                                
-                                # Save the image
-                                with open(filepath, 'wb') as f:
-                                    f.write(image_response.content)
-                                
-                                # Update book's cover_image field
-                                book.cover_image = f'book_covers/{filename}'
-                                book.save()
-                                
-                                success_count += 1
-                                self.stdout.write(
-                                    self.style.SUCCESS(f'Successfully downloaded cover for "{book.title}"')
-                                )
-                            else:
-                                fail_count += 1
-                                self.stdout.write(
-                                    self.style.WARNING(f'Failed to download image for "{book.title}"')
-                                )
-                        else:
-                            fail_count += 1
-                            self.stdout.write(
-                                self.style.WARNING(f'No cover image found for "{book.title}"')
-                            )
-                    else:
-                        fail_count += 1
-                        self.stdout.write(
-                            self.style.WARNING(f'No results found for "{book.title}"')
-                        )
-                else:
-                    fail_count += 1
-                    self.stdout.write(
-                        self.style.ERROR(f'API request failed for "{book.title}"')
-                    )
-                    
-            except Exception as e:
-                fail_count += 1
-                self.stdout.write(
-                    self.style.ERROR(f'Error processing "{book.title}": {str(e)}')
-                )
+        self.api_url = options['api_url']
+        self.timeout = options['timeout']
+        self.force = options['force']
+        self.session = self.build_session(options)
+        self.limiter = HostRateLimiter(options['rate'])
+        checkpoint_path = options['checkpoint']
+        if not checkpoint_path:
+            checkpoint_dir = os.path.join(settings.MEDIA_ROOT, 'book_covers')
+            os.makedirs(checkpoint_dir, exist_ok=True)
+            checkpoint_path = os.path.join(checkpoint_dir, '.download_checkpoint.json')
+        checkpoint = Checkpoint(checkpoint_path, reset=options['reset'])
+
+        counts = {'downloaded': 0, 'existing': 0, 'failed': 0}
+        pending_updates = []
+        in_flight = {}
+        last_pk = checkpoint.last_pk
+        started = time.monotonic()
+        # Books finished since the checkpoint was last saved, and when
+        progress = {'handled': 0, 'saved_at': started}
 
+        def finish(book, outcome, message):
+            counts[outcome] += 1
+            COVER_DOWNLOADS.inc(outcome=outcome)
+            if outcome == 'failed':
+                checkpoint.failed.add(book.pk)
+                self.stdout.write(self.style.WARNING(f'{message} for "{book.title}"'))
+                return
+            checkpoint.failed.discard(book.pk)
+            if outcome == 'downloaded':
+                # A new image needs its variants regenerated
+                book.cover_hash = ''
+                pending_updates.append(book)
+
+        def save_progress():
+            # Also on runs of failures and skips, which update no book
+            progress['handled'] += 1
+            if len(pending_updates) < options['batch_size'] and progress['handled'] < options['batch_size'] \
+                    and time.monotonic() - progress['saved_at'] < CHECKPOINT_INTERVAL:
+                return
+            # Books are submitted in id order, so everything below the
+            # oldest one still in flight is finished.
+            watermark = min((b.pk for b in in_flight.values()), default=last_pk + 1) - 1
+            self.flush(pending_updates, checkpoint, watermark)
+            progress['handled'] = 0
+            progress['saved_at'] = time.monotonic()
+
+        books = Book.objects.only('title', 'author', 'slug', 'cover_image', 'cover_hash').order_by('pk')
+        if checkpoint.last_pk and not self.force:
+            self.stdout.write(
+                f'Resuming after book id {checkpoint.last_pk}, '
+                f'retrying {len(checkpoint.failed)} earlier failures'
+            )
+            books = books.filter(Q(pk__gt=checkpoint.last_pk) | Q(pk__in=checkpoint.failed))
+        max_in_flight = options['workers'] * 4
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for book in books.iterator(chunk_size=1000):
+                last_pk = book.pk
+                # Any real cover counts, whatever it is named; placeholders don't
+                if not self.force and has_cover(book.cover_image.name):
+                    finish(book, 'existing', '')
+                    save_progress()
+                    continue
+                in_flight[executor.submit(self.fetch_cover, book)] = book
+                # Keep the number of queued books bounded
+                if len(in_flight) >= max_in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        finish(in_flight.pop(future), *future.result())
+                        save_progress()
+            for future in list(in_flight):
+                finish(in_flight.pop(future), *future.result())
+
+        self.flush(pending_updates, checkpoint, last_pk)
+        self.session.close()
+        REGISTRY.flush()
+
+        elapsed = time.monotonic() - started
         self.stdout.write(
             self.style.SUCCESS(
-                f'Finished downloading book covers. Success: {success_count}, Failed: {fail_count}'
+                f"Finished downloading book covers in {elapsed:.1f}s. "
+                f"Downloaded: {counts['downloaded']}, Already present: {counts['existing']}, "
+                f"Failed: {counts['failed']}"
+            )
+        )
+
+    def build_session(self, options):
+        # Retries are made by get(), so that they go through the rate limiter
+        self.retries = options['retries']
+        self.backoff = options['backoff']
+        adapter = HTTPAdapter(
+            pool_connections=options['workers'],
+            pool_maxsize=options['workers'],
+            max_retries=0,
+        )
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def cover_name(self, book):
+        return f'book_covers/{book.slug}.jpg'
+
+    def get(self, url, **kwargs):
+        """GET through the per-host rate limiter, retrying with exponential backoff."""
+        for attempt in range(self.retries + 1):
+            self.limiter.wait(url)
+            last_attempt = attempt == self.retries
+            try:
+                response = self.session.get(url, timeout=self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if last_attempt:
+                    raise
+                delay = self.backoff * 2 ** attempt
+            else:
+                if response.status_code not in RETRY_STATUSES or last_attempt:
+                    return response
+                retry_after = response.headers.get('Retry-After', '')
+                delay = float(retry_after) if retry_after.isdigit() else self.backoff * 2 ** attempt
+                response.close()
+            time.sleep(min(delay, MAX_BACKOFF))
+
+    def fetch_cover(self, book):
+        """
+        Runs in a worker thread; stores the cover, points ``book`` at it and
+        returns ``(outcome, message)``.
+        """
+        try:
+            # Search for the book in Google Books API
+            response = self.get(self.api_url, params={'q': f'{book.title} {book.author}'})
+            if response.status_code != 200:
+                return 'failed', f'API request failed ({response.status_code})'
+
+            items = response.json().get('items')
+            if not items:
+                return 'failed', 'No results found'
+
+            image_links = items[0].get('volumeInfo', {}).get('imageLinks', {})
+            image_url = next(
+                (image_links[quality] for quality in IMAGE_QUALITIES if quality in image_links),
+                None,
             )
-        ) 
\ No newline at end of file
+            if not image_url:
+                return 'failed', 'No cover image found'
+
+            image_response = self.get(image_url)
+            if image_response.status_code != 200:
+                return 'failed', f'Failed to download image ({image_response.status_code})'
+
+            # A file left by an interrupted run is replaced, not renamed around
+            name = self.cover_name(book)
+            if default_storage.exists(name):
+                default_storage.delete(name)
+            book.cover_image = default_storage.save(name, ContentFile(image_response.content))
+            return 'downloaded', ''
+        except (requests.RequestException, ValueError, OSError) as e:
+            return 'failed', f'Error: {e}'
+        except Exception as e:
+            # An unexpected response shape must not stop the whole run
+            return 'failed', f'Unexpected error: {e!r}'
+
+    def flush(self, books, checkpoint, last_pk):
+        if books:
+            # bulk_update() skips auto_now; the page ETags key on updated_at
+            now = timezone.now()
+            for book in books:
+                book.updated_at = now
+            Book.objects.bulk_update(books, ['cover_image', 'cover_hash', 'updated_at'])
+            notify_books_updated((book.pk for book in books), ['cover_image', 'cover_hash', 'updated_at'])
+            books.clear()
+        checkpoint.save(last_pk)
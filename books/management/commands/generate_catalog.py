@@ -0,0 +1,338 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import slugify
+from books.bulk import keep_timestamps, raw_delete
+from books.covers import placeholder_cover
+from books.inventory import SOLD_OUT_STATUS
+from books.models import Book, Category, Review
+from books.ratings import defer_rating_updates
+from books.slugs import SlugAllocator
+from books.versions import bump_version
+from transactions.models import Transaction, Wishlist
+from decimal import Decimal
+from itertools import accumulate
+import datetime
+import random
+import time
+
+GENRES = [
+    'Fiction', 'Mystery', 'Science Fiction', 'Fantasy', 'Romance', 'Thriller', 'Biography',
+    'History', 'Poetry', 'Self-Help', 'Business', 'Philosophy', 'Travel', 'Cooking', 'Art',
+    'Children', 'Young Adult', 'Horror', 'Religion', 'Science', 'Health', 'Humor', 'Sports',
+    'Politics', 'Music', 'Education', 'Drama', 'Classics', 'Graphic Novels', 'True Crime',
+]
+TITLE_WORDS = [
+    'Silent', 'River', 'Midnight', 'Garden', 'Shadow', 'Empire', 'Library', 'Storm', 'Glass',
+    'Winter', 'Echo', 'Harbor', 'Crown', 'Desert', 'Memory', 'Light', 'Orchard', 'Signal',
+    'Iron', 'Paper', 'Ocean', 'Forest', 'Lantern', 'Tide', 'Stone', 'Fire', 'Map', 'Clock',
+    'Letter', 'Machine', 'Sparrow', 'Bridge', 'Island', 'Winds', 'Secret', 'Last', 'Hidden',
+]
+FIRST_NAMES = [
+    'Ada', 'Ben', 'Clara', 'David', 'Elena', 'Farid', 'Grace', 'Hiro', 'Ines', 'Jonas',
+    'Kavya', 'Liam', 'Maya', 'Noah', 'Olga', 'Priya', 'Quinn', 'Rosa', 'Sami', 'Tara',
+]
+LAST_NAMES = [
+    'Adams', 'Bose', 'Chen', 'Diaz', 'Evans', 'Fischer', 'Garcia', 'Haddad', 'Ito', 'Jensen',
+    'Khan', 'Lopez', 'Moreau', 'Novak', 'Okafor', 'Patel', 'Rossi', 'Silva', 'Tanaka', 'Weber',
+]
+PUBLISHERS = ['Penguin', 'Vintage', 'Harper', 'Scribner', 'Knopf', 'Viking', 'Ace', 'Orbit', 'Tor', 'Norton']
+# Skewed towards English like a real catalog
+LANGUAGES = ['English'] * 16 + ['Spanish', 'French', 'German', 'Hindi']
+TRANSACTION_TYPES = ['borrow'] * 5 + ['rent'] * 3 + ['purchase'] * 2 + ['return'] * 4
+# Generated ISBNs are '9', the seed in SEED_DIGITS digits and the book's
+# index in the rest of the 13
+SEED_DIGITS = 5
+INDEX_DIGITS = 13 - 1 - SEED_DIGITS
+
+
+class Command(BaseCommand):
+    help = 'Generates a deterministic synthetic catalog for load testing (no network access)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=10000)
+        parser.add_argument('--categories', type=int, default=50)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--reviews', type=int, default=50000)
+        parser.add_argument('--transactions', type=int, default=20000)
+        parser.add_argument('--wishlists', type=int, default=None, help='Users with a wishlist (default: half)')
+        parser.add_argument('--wishlist-size', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent for popularity')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--covers', type=int, default=12, help='Distinct placeholder covers')
+        parser.add_argument('--clear', action='store_true', help='Delete data generated earlier with this seed')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['books'] < 1 or options['categories'] < 1:
+            raise CommandError('--books, --categories and --batch-size must be positive')
+        if options['reviews'] and options['users'] < 1:
+            raise CommandError('Reviews need at least one user')
+        if not 0 <= options['seed'] < 10 ** SEED_DIGITS:
+            raise CommandError(f'--seed must be between 0 and {10 ** SEED_DIGITS - 1}')
+        if options['books'] > 10 ** INDEX_DIGITS:
+            raise CommandError(f'--books can be at most {10 ** INDEX_DIGITS}')
+
+        self.rng = random.Random(options['seed'])
+        self.seed = options['seed']
+        self.batch_size = options['batch_size']
+        self.skew = options['skew']
+        # Generated rows are recognisable by these prefixes, per seed
+        self.isbn_prefix = f'9{self.seed:0{SEED_DIGITS}d}'
+        self.username_prefix = f'loadtest-{self.seed}-'
+        self.category_suffix = f'-lt{self.seed}'
+
+        existing = Book.objects.filter(isbn__startswith=self.isbn_prefix)
+        if options['clear']:
+            self.clear()
+        elif existing.exists():
+            raise CommandError(f'A catalog was already generated with seed {self.seed}; use --clear to replace it')
+
+        started = time.monotonic()
+        covers = self.create_covers(options['covers'])
+        categories = self.create_categories(options['categories'])
+        book_ids = self.create_books(options['books'], categories, covers)
+        user_ids = self.create_users(options['users'])
+        popularity = self.popularity_weights(len(book_ids))
+        self.create_reviews(options['reviews'], book_ids, user_ids, popularity)
+        self.create_transactions(options['transactions'], book_ids, user_ids, popularity)
+        wishlists = options['wishlists'] if options['wishlists'] is not None else len(user_ids) // 2
+        self.create_wishlists(min(wishlists, len(user_ids)), options['wishlist_size'], book_ids, user_ids, popularity)
+
+        # Bulk inserts skip the Book signals
+        bump_version('catalog')
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated catalog in {elapsed:.1f}s. Run rebuild_search_index to index the new books.'
+        ))
+
+    def clear(self):
+        self.stdout.write(f'Deleting data generated with seed {self.seed}...')
+        started = time.monotonic()
+        User = get_user_model()
+        # Table-wide DELETEs: the ORM cascade would load every row and send
+        # per-row signals for books, reviews and transactions.
+        with transaction.atomic():
+            books = raw_delete(Book.objects.filter(isbn__startswith=self.isbn_prefix))
+            users = raw_delete(User.objects.filter(username__startswith=self.username_prefix))
+            raw_delete(Category.objects.filter(slug__endswith=self.category_suffix))
+        bump_version('catalog')
+        elapsed = time.monotonic() - started
+        self.stdout.write(f'Deleted {books} books and {users} users in {elapsed:.1f}s')
+
+    def zipf_weights(self, n):
+        return list(accumulate(1 / (rank ** self.skew) for rank in range(1, n + 1)))
+
+    def popularity_weights(self, n):
+        # Cumulative Zipf weights over a shuffled order, so popular titles are
+        # spread across categories instead of being the oldest ids
+        order = list(range(n))
+        self.rng.shuffle(order)
+        weights = [0.0] * n
+        for rank, index in enumerate(order, start=1):
+            weights[index] = 1 / (rank ** self.skew)
+        return list(accumulate(weights))
+
+    def progress(self, label, done, total, started):
+        elapsed = time.monotonic() - started
+        rate = done / elapsed if elapsed else 0
+        self.stdout.write(f'{label}: {done}/{total} ({rate:.0f} rows/sec)')
+
+    def bulk_create(self, label, model, rows, total, prepare=None, **kwargs):
+        started = time.monotonic()
+        done = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                if prepare:
+                    prepare(batch)
+                model.objects.bulk_create(batch, **kwargs)
+                done += len(batch)
+                batch = []
+                self.progress(label, done, total, started)
+        if batch:
+            if prepare:
+                prepare(batch)
+            model.objects.bulk_create(batch, **kwargs)
+            done += len(batch)
+        self.progress(label, done, total, started)
+        return done
+
+    def create_covers(self, count):
+        """Placeholder covers drawn locally, with their variants."""
+        return [placeholder_cover(index) for index in range(max(count, 1))]
+
+    def create_categories(self, count):
+        categories = []
+        for index in range(count):
+            genre = GENRES[index % len(GENRES)]
+            name = genre if index < len(GENRES) else f'{genre} {index // len(GENRES) + 1}'
+            categories.append(Category(
+                name=name,
+                slug=f'{slugify(name)}{self.category_suffix}',
+                description=f'Generated {name.lower()} titles',
+            ))
+        Category.objects.bulk_create(categories)
+        self.stdout.write(f'Categories: {count}')
+        return list(
+            Category.objects.filter(slug__endswith=self.category_suffix).order_by('pk').values_list('pk', flat=True)
+        )
+
+    def generate_books(self, count, categories, covers):
+        rng = self.rng
+        # Long-tail categories: a few hold most of the catalog
+        category_weights = self.zipf_weights(len(categories))
+        now = timezone.now()
+        for index in range(count):
+            words = rng.sample(TITLE_WORDS, rng.randint(1, 3))
+            title = f"The {' '.join(words)}" if rng.random() < 0.4 else ' '.join(words)
+            isbn = f'{self.isbn_prefix}{index:0{INDEX_DIGITS}d}'
+            price = Decimal(rng.randint(499, 4999)) / 100
+            cover_name, cover_hash = covers[rng.randrange(len(covers))]
+            yield Book(
+                title=title,
+                author=f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+                category_id=rng.choices(categories, cum_weights=category_weights)[0],
+                description=f'{title} is a generated book about {" and ".join(w.lower() for w in words)}.',
+                isbn=isbn,
+                cover_image=cover_name,
+                cover_hash=cover_hash,
+                publication_date=datetime.date(1950, 1, 1) + datetime.timedelta(days=rng.randrange(27000)),
+                publisher=rng.choice(PUBLISHERS),
+                pages=rng.randint(80, 1200),
+                language=rng.choice(LANGUAGES),
+                price=price,
+                rental_price=(price / 5).quantize(Decimal('0.01')) if rng.random() < 0.8 else None,
+                # Loans and purchases in create_transactions() take copies
+                # out and sell some books out
+                quantity=rng.randint(1, 10),
+                created_at=now - datetime.timedelta(minutes=index * 7 + rng.randrange(7)),
+            )
+
+    def create_books(self, count, categories, covers):
+        slugs = SlugAllocator(Book)
+
+        def assign_slugs(books):
+            for book, slug in zip(books, slugs.allocate([book.title for book in books])):
+                book.slug = slug
+
+        with keep_timestamps(Book, 'created_at'):
+            books = self.generate_books(count, categories, covers)
+            self.bulk_create('Books', Book, books, count, prepare=assign_slugs)
+        # Ids in generation order (ISBNs are zero-padded sequence numbers)
+        return list(
+            Book.objects.filter(isbn__startswith=self.isbn_prefix).order_by('isbn').values_list('pk', flat=True)
+        )
+
+    def create_users(self, count):
+        User = get_user_model()
+        password = make_password(None)
+        users = (
+            User(
+                username=f'{self.username_prefix}{index:07d}',
+                email=f'reader{index}@loadtest.invalid',
+                password=password,
+            )
+            for index in range(count)
+        )
+        self.bulk_create('Users', User, users, count)
+        return list(
+            User.objects.filter(username__startswith=self.username_prefix).order_by('username').values_list('pk', flat=True)
+        )
+
+    def generate_reviews(self, count, book_ids, user_ids, popularity):
+        rng = self.rng
+        seen = set()
+        now = timezone.now()
+        attempts = 0
+        while len(seen) < count and attempts < count * 3:
+            attempts += 1
+            book_id = rng.choices(book_ids, cum_weights=popularity)[0]
+            user_id = user_ids[rng.randrange(len(user_ids))]
+            # One review per (book, user)
+            if (book_id, user_id) in seen:
+                continue
+            seen.add((book_id, user_id))
+            yield Review(
+                book_id=book_id,
+                user_id=user_id,
+                rating=rng.choices([1, 2, 3, 4, 5], weights=[5, 7, 15, 35, 38])[0],
+                comment='Generated review.',
+                created_at=now - datetime.timedelta(minutes=rng.randrange(525600)),
+                updated_at=now,
+            )
+
+    def create_reviews(self, count, book_ids, user_ids, popularity):
+        if not count:
+            return
+        count = min(count, len(book_ids) * len(user_ids))
+        with defer_rating_updates() as affected_books, keep_timestamps(Review, 'created_at'):
+            reviews = self.generate_reviews(count, book_ids, user_ids, popularity)
+            self.bulk_create('Reviews', Review, reviews, count)
+            affected_books.update(book_ids)
+            self.stdout.write('Recomputing ratings...')
+
+    def create_transactions(self, count, book_ids, user_ids, popularity):
+        if not count or not user_ids:
+            return
+        rng = self.rng
+        now = timezone.now()
+        initial = dict(Book.objects.filter(isbn__startswith=self.isbn_prefix).values_list('pk', 'quantity'))
+        stock = dict(initial)
+        sold_out = {}
+
+        def generate():
+            for _ in range(count):
+                transaction_type = rng.choice(TRANSACTION_TYPES)
+                book_id = rng.choices(book_ids, cum_weights=popularity)[0]
+                if transaction_type in SOLD_OUT_STATUS:
+                    if not stock[book_id]:
+                        # No copy left: an earlier loan that was returned
+                        transaction_type = 'return'
+                    else:
+                        # Open loans and purchases hold a copy, as with reserve_copy()
+                        stock[book_id] -= 1
+                        if not stock[book_id]:
+                            sold_out[book_id] = SOLD_OUT_STATUS[transaction_type]
+                yield Transaction(
+                    transaction_type=transaction_type,
+                    book_id=book_id,
+                    user_id=user_ids[rng.randrange(len(user_ids))],
+                    amount=Decimal(rng.randint(0, 3000)) / 100 if transaction_type != 'borrow' else 0,
+                    due_date=now + datetime.timedelta(days=rng.randint(-30, 14)) if transaction_type in ('borrow', 'rent') else None,
+                    status='completed',
+                )
+
+        self.bulk_create('Transactions', Transaction, generate(), count)
+        books = [
+            Book(pk=pk, quantity=quantity, availability_status=sold_out.get(pk, 'available'))
+            for pk, quantity in stock.items()
+            if quantity != initial[pk]
+        ]
+        Book.objects.bulk_update(books, ['quantity', 'availability_status'], batch_size=self.batch_size)
+        self.stdout.write(f'Stock: {len(books)} books lent or sold, {len(sold_out)} of them out of copies')
+
+    def create_wishlists(self, count, size, book_ids, user_ids, popularity):
+        if not count:
+            return
+        rng = self.rng
+        with transaction.atomic():
+            owners = rng.sample(user_ids, count)
+            self.bulk_create('Wishlists', Wishlist, (Wishlist(user_id=user_id) for user_id in owners), count)
+            wishlist_ids = list(
+                Wishlist.objects.filter(user__username__startswith=self.username_prefix)
+                .order_by('pk')
+                .values_list('pk', flat=True)
+            )
+            Through = Wishlist.books.through
+
+            def generate():
+                for wishlist_id in wishlist_ids:
+                    books = {rng.choices(book_ids, cum_weights=popularity)[0] for _ in range(size)}
+                    for book_id in sorted(books):
+                        yield Through(wishlist_id=wishlist_id, book_id=book_id)
+
+            self.bulk_create('Wishlist entries', Through, generate(), len(wishlist_ids) * size, ignore_conflicts=True)
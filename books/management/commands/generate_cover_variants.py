@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from books.covers import generate_variants
+from books.models import Book
+from books.signals import notify_book_updated
+import time
+
+class Command(BaseCommand):
+    help = 'Generates resized WebP/JPEG cover variants named by content hash'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Re-hash covers that already have variants')
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        books = Book.objects.exclude(cover_image='').only('slug', 'title', 'cover_image', 'cover_hash')
+        if not options['all']:
+            books = books.filter(cover_hash='')
+
+        started = time.monotonic()
+        processed = written = failed = 0
+        seen_hashes = set()
+        pending = []
+        for book in books.order_by('pk').iterator(chunk_size=1000):
+            try:
+                with default_storage.open(book.cover_image.name, 'rb') as f:
+                    data = f.read()
+                cover_hash, files = generate_variants(data)
+            except Exception as e:
+                failed += 1
+                self.stdout.write(self.style.WARNING(f'Could not process cover for "{book.title}": {e}'))
+                continue
+
+            processed += 1
+            written += files
+            seen_hashes.add(cover_hash)
+            if book.cover_hash != cover_hash:
+                book.cover_hash = cover_hash
+                pending.append(book)
+            if len(pending) >= options['batch_size']:
+                self.save(pending)
+
+        self.save(pending)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {processed} covers ({len(seen_hashes)} distinct images) in {elapsed:.1f}s. '
+            f'Wrote {written} variant files, {failed} failed.'
+        ))
+
+    def save(self, books):
+        # bulk_update() skips auto_now; the page ETags key on updated_at
+        now = timezone.now()
+        for book in books:
+            book.updated_at = now
+        Book.objects.bulk_update(books, ['cover_hash', 'updated_at'])
+        for book in books:
+            notify_book_updated(book, ['cover_hash', 'updated_at'])
+        books.clear()
@@ -0,0 +1,221 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from books.forms import BookImportForm
+from books.models import Book, Category
+from books.slugs import SlugAllocator
+from books.search import get_backend
+from books.signals import notify_books_updated
+from books.versions import bump_version
+import csv
+import json
+import time
+
+# Columns an import overwrites on an existing ISBN; slug (URLs), ratings
+# and created_at stay as they are.
+UPDATE_FIELDS = [
+    'title', 'author', 'category', 'description', 'publication_date', 'publisher', 'pages',
+    'language', 'price', 'updated_at',
+]
+# Optional columns, only overwritten when the row has a value for them.
+# Inventory state is live data: a feed without it must not reset a book
+# that is on loan.
+OPTIONAL_FIELDS = ['rental_price', 'quantity', 'availability_status', 'cover_image']
+# A batch that loses a race for an ISBN or slug is redone this many times
+UPSERT_ATTEMPTS = 3
+
+
+class Command(BaseCommand):
+    help = 'Streams a partner catalog (CSV or JSONL) into the database, upserting on ISBN'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--rejects', help='Where to write rejected rows (default: <path>.rejects.jsonl)')
+        parser.add_argument(
+            '--create-categories',
+            action='store_true',
+            help='Create unknown categories instead of rejecting their rows',
+        )
+
+    def read_rows(self, path, fmt):
+        with open(path, newline='', encoding='utf-8') as f:
+            if fmt == 'csv':
+                for number, row in enumerate(csv.DictReader(f), start=2):
+                    yield number, row
+            else:
+                for number, line in enumerate(f, start=1):
+                    if not line.strip():
+                        continue
+                    try:
+                        row = json.loads(line)
+                    except ValueError as e:
+                        yield number, {'_error': f'Invalid JSON: {e}'}
+                        continue
+                    yield number, row if isinstance(row, dict) else {'_error': 'Expected a JSON object'}
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        self.create_categories = options['create_categories']
+        # Resolved once; new categories are added as they appear
+        self.categories = {
+            name.strip().lower(): pk for pk, name in Category.objects.values_list('pk', 'name')
+        }
+        self.stats = {'read': 0, 'created': 0, 'updated': 0, 'rejected': 0}
+
+        rejects_path = options['rejects'] or f'{path}.rejects.jsonl'
+        started = time.monotonic()
+        with open(rejects_path, 'w', encoding='utf-8') as self.rejects:
+            batch = {}
+            for number, row in self.read_rows(path, fmt):
+                self.stats['read'] += 1
+                built = self.build_book(number, row)
+                if built is None:
+                    continue
+                # A later row for the same ISBN replaces an earlier one
+                batch[built[0].isbn] = built
+                if len(batch) >= options['batch_size']:
+                    self.upsert(list(batch.values()))
+                    batch = {}
+                    self.report(started)
+            if batch:
+                self.upsert(list(batch.values()))
+
+        # Bulk writes skip the Book signals
+        bump_version('catalog')
+        elapsed = time.monotonic() - started
+        rate = self.stats['read'] / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Read {self.stats['read']} rows in {elapsed:.1f}s ({rate:.0f} rows/sec): "
+            f"{self.stats['created']} created, {self.stats['updated']} updated, "
+            f"{self.stats['rejected']} rejected (see {rejects_path})."
+        ))
+
+    def report(self, started):
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f"{self.stats['read']} rows read ({self.stats['read'] / elapsed:.0f} rows/sec), "
+            f"{self.stats['rejected']} rejected"
+        )
+
+    def reject(self, number, row, errors):
+        self.stats['rejected'] += 1
+        self.rejects.write(json.dumps({'line': number, 'row': row, 'errors': errors}, default=str) + '\n')
+
+    def category_id(self, name):
+        key = name.strip().lower()
+        if key not in self.categories and self.create_categories:
+            category = Category.objects.filter(name__iexact=name.strip()).first()
+            if category is None:
+                # save() allocates a unique slug, also for names that slugify to ''
+                category = Category(name=name.strip())
+                category.save()
+            self.categories[key] = category.pk
+        return self.categories.get(key)
+
+    def build_book(self, number, row):
+        if '_error' in row:
+            self.reject(number, row, {'row': [row.pop('_error')]})
+            return None
+        data = {key: (value.strip() if isinstance(value, str) else value) for key, value in row.items() if key}
+        if isinstance(data.get('isbn'), str):
+            data['isbn'] = data['isbn'].replace('-', '').replace(' ', '').upper()
+        form = BookImportForm(data)
+        if not form.is_valid():
+            self.reject(number, row, form.errors.get_json_data())
+            return None
+
+        cleaned = form.cleaned_data
+        category_id = self.category_id(cleaned['category'])
+        if category_id is None:
+            self.reject(number, row, {'category': [f"Unknown category {cleaned['category']!r}"]})
+            return None
+        # Columns the row actually provides; blanks count as missing
+        present = tuple(
+            field for field in OPTIONAL_FIELDS if cleaned[field] is not None and cleaned[field] != ''
+        )
+        quantity = cleaned['quantity'] if cleaned['quantity'] is not None else 1
+        book = Book(
+            isbn=cleaned['isbn'],
+            title=cleaned['title'],
+            author=cleaned['author'],
+            category_id=category_id,
+            description=cleaned['description'],
+            publication_date=cleaned['publication_date'],
+            publisher=cleaned['publisher'],
+            pages=cleaned['pages'],
+            language=cleaned['language'],
+            price=cleaned['price'],
+            rental_price=cleaned['rental_price'],
+            quantity=quantity,
+            availability_status=cleaned['availability_status'] or ('available' if quantity else 'sold'),
+            cover_image=cleaned['cover_image'],
+            updated_at=timezone.now(),
+        )
+        return book, present
+
+    def upsert(self, rows):
+        for attempt in range(UPSERT_ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    created, updated = self.write_batch(rows)
+                break
+            except IntegrityError:
+                # A concurrent import inserted one of these ISBNs or slugs
+                # first; the next attempt sees it and updates that row
+                if attempt == UPSERT_ATTEMPTS - 1:
+                    raise
+                for book, present in rows:
+                    book.pk = None
+        self.stats['updated'] += updated
+        self.stats['created'] += created
+
+    def write_batch(self, rows):
+        """Insert or update one batch; returns ``(created, updated)``."""
+        isbns = [book.isbn for book, present in rows]
+        existing = {
+            isbn: (pk, cover_image, status)
+            for isbn, pk, cover_image, status in Book.objects.filter(isbn__in=isbns)
+            .values_list('isbn', 'pk', 'cover_image', 'availability_status')
+        }
+        # Only new ISBNs need a slug; existing rows keep theirs. A fresh
+        # allocator per batch keeps memory flat: earlier batches are in the
+        # table by now.
+        new_books = [book for book, present in rows if book.isbn not in existing]
+        slugs = SlugAllocator(Book).allocate([book.title for book in new_books])
+        for book, slug in zip(new_books, slugs):
+            book.slug = slug
+        Book.objects.bulk_create(new_books)
+        if new_books and not connection.features.can_return_rows_from_bulk_insert:
+            # The search index needs the new ids
+            ids = dict(Book.objects.filter(isbn__in=[book.isbn for book in new_books]).values_list('isbn', 'pk'))
+            for book in new_books:
+                book.pk = ids[book.isbn]
+
+        # Rows are updated in groups that provide the same columns
+        updates = {}
+        for book, present in rows:
+            if book.isbn not in existing:
+                continue
+            book.pk, cover_image, status = existing[book.isbn]
+            fields = UPDATE_FIELDS + list(present)
+            if 'quantity' in present and 'availability_status' not in present \
+                    and status in ('available', 'sold'):
+                # Books out on loan keep their status
+                fields.append('availability_status')
+            if 'cover_image' in present and book.cover_image.name != cover_image:
+                # The variants were made from the old file
+                book.cover_hash = ''
+                fields.append('cover_hash')
+            updates.setdefault(tuple(fields), []).append(book)
+        for fields, books in updates.items():
+            Book.objects.bulk_update(books, fields)
+
+        get_backend().index_books([book for book, present in rows])
+        # Drop cached copies of the books that changed
+        notify_books_updated(pk for pk, cover_image, status in existing.values())
+        return len(new_books), len(existing)
@@ -0,0 +1,149 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+from django.utils.dateparse import parse_datetime
+from django.utils import timezone
+from books.models import Book, Review
+from books.bulk import keep_timestamps
+from books.metrics import REGISTRY, REVIEW_WRITES
+from books.ratings import defer_rating_updates
+import csv
+import json
+import time
+
+
+class Command(BaseCommand):
+    help = 'Bulk imports reviews from CSV or JSONL (columns: isbn, username, rating, comment, created_at)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--rejects', help='Where to write rejected rows (default: <path>.rejects.jsonl)')
+
+    def read_rows(self, path, fmt):
+        with open(path, newline='', encoding='utf-8') as f:
+            if fmt == 'csv':
+                for number, row in enumerate(csv.DictReader(f), start=2):
+                    yield number, row
+            else:
+                for number, line in enumerate(f, start=1):
+                    if not line.strip():
+                        continue
+                    try:
+                        row = json.loads(line)
+                    except ValueError as e:
+                        yield number, {'_error': f'Invalid JSON: {e}'}
+                        continue
+                    yield number, row if isinstance(row, dict) else {'_error': 'Expected a JSON object'}
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be positive')
+
+        self.stats = {'read': 0, 'imported': 0, 'duplicates': 0, 'rejected': 0}
+        rejects_path = options['rejects'] or f'{path}.rejects.jsonl'
+        started = time.monotonic()
+        batch = []
+        # Historical reviews keep their original created_at
+        with open(rejects_path, 'w', encoding='utf-8') as self.rejects, \
+                defer_rating_updates() as affected_books, keep_timestamps(Review, 'created_at'):
+            for number, row in self.read_rows(path, fmt):
+                self.stats['read'] += 1
+                if '_error' in row:
+                    self.reject(number, row, [row.pop('_error')])
+                    continue
+                batch.append((number, row))
+                if len(batch) >= batch_size:
+                    self.import_batch(batch, affected_books)
+                    batch = []
+                    self.report(started)
+            if batch:
+                self.import_batch(batch, affected_books)
+            self.stdout.write(f'Recomputing ratings for {len(affected_books)} books...')
+
+        REGISTRY.flush()
+        elapsed = time.monotonic() - started
+        rate = self.stats['read'] / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {self.stats['imported']} reviews, skipped {self.stats['duplicates']} for "
+            f"book/user pairs that already had one and rejected {self.stats['rejected']} rows (see {rejects_path}) "
+            f"in {elapsed:.1f}s ({rate:.0f} rows/sec)"
+        ))
+
+    def report(self, started):
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f"{self.stats['read']} rows read ({self.stats['read'] / elapsed:.0f} rows/sec)"
+        )
+
+    def reject(self, number, row, errors):
+        self.stats['rejected'] += 1
+        self.rejects.write(json.dumps({'line': number, 'row': row, 'errors': errors}, default=str) + '\n')
+
+    def import_batch(self, rows, affected_books):
+        # Resolve books and users for the whole batch with two queries
+        isbns = {str(row.get('isbn') or '').strip() for number, row in rows}
+        usernames = {str(row.get('username') or '').strip() for number, row in rows}
+        books = dict(Book.objects.filter(isbn__in=isbns).values_list('isbn', 'pk'))
+        users = dict(
+            get_user_model().objects.filter(username__in=usernames).values_list('username', 'pk')
+        )
+
+        reviews = {}
+        now = timezone.now()
+        for number, row in rows:
+            review, error = self.build_review(row, books, users, now)
+            if review is None:
+                self.reject(number, row, [error])
+                continue
+            # The first row for a book/user pair wins, as for stored reviews
+            if (review.book_id, review.user_id) in reviews:
+                self.stats['duplicates'] += 1
+            else:
+                reviews[review.book_id, review.user_id] = review
+
+        # Reviews that already exist for a (book, user) pair are left alone
+        existing = set(
+            Review.objects.filter(
+                book_id__in={book_id for book_id, user_id in reviews},
+                user_id__in={user_id for book_id, user_id in reviews},
+            ).values_list('book_id', 'user_id')
+        )
+        new_reviews = [review for pair, review in reviews.items() if pair not in existing]
+        # ignore_conflicts still covers reviews written since the check
+        Review.objects.bulk_create(new_reviews, ignore_conflicts=True)
+        affected_books.update(review.book_id for review in new_reviews)
+        self.stats['imported'] += len(new_reviews)
+        self.stats['duplicates'] += len(reviews) - len(new_reviews)
+        REVIEW_WRITES.inc(len(new_reviews), action='import')
+
+    def build_review(self, row, books, users, now):
+        book_id = books.get(str(row.get('isbn') or '').strip())
+        if book_id is None:
+            return None, f"Unknown ISBN {row.get('isbn')!r}"
+        user_id = users.get(str(row.get('username') or '').strip())
+        if user_id is None:
+            return None, f"Unknown user {row.get('username')!r}"
+        try:
+            rating = int(row.get('rating'))
+            created_at = parse_datetime(str(row.get('created_at') or '')) or now
+        except (TypeError, ValueError):
+            return None, 'Invalid rating or created_at'
+        if not 1 <= rating <= 5:
+            return None, f'Rating {rating} is not between 1 and 5'
+        comment = row.get('comment') or ''
+        if not isinstance(comment, str):
+            return None, 'Comment must be text'
+        if timezone.is_naive(created_at):
+            created_at = timezone.make_aware(created_at)
+        return Review(
+            book_id=book_id,
+            user_id=user_id,
+            rating=rating,
+            comment=comment,
+            created_at=created_at,
+            updated_at=now,
+        ), None
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from books.middleware import PROFILE_MODES, PROFILE_TOKEN_MAX_AGE, profile_token
+
+class Command(BaseCommand):
+    help = 'Prints a signed X-Profile-Token header value for profiling requests on demand'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=PROFILE_MODES, default='cprofile')
+
+    def handle(self, *args, **options):
+        self.stdout.write(profile_token(options['mode']))
+        self.stderr.write(f'Valid for {PROFILE_TOKEN_MAX_AGE} seconds; send it as the X-Profile-Token header.')
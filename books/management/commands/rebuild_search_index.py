@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from books.models import Book
+from books.search import get_backend
+import time
+
+class Command(BaseCommand):
+    help = 'Rebuilds the catalog full-text search index from every book'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        count = get_backend().rebuild(Book.objects.order_by('pk'), batch_size=options['batch_size'])
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {count} books in {elapsed:.1f}s'
+        ))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from books.ratings import reconcile_ratings
+import time
+
+class Command(BaseCommand):
+    help = 'Recomputes book rating counters and star histograms from reviews and fixes any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report how many books have drifted',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        checked, fixed = reconcile_ratings(
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run'],
+        )
+        elapsed = time.monotonic() - started
+        action = 'Found' if options['dry_run'] else 'Fixed'
+        self.stdout.write(self.style.SUCCESS(
+            f'Checked {checked} books in {elapsed:.1f}s. {action} {fixed} with drifted ratings.'
+        ))
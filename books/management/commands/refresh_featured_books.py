@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from books.featured import CANDIDATE_FACTOR, FEATURED_COUNT, refresh_featured_books
+import time
+
+class Command(BaseCommand):
+    help = 'Recomputes the featured books ranking shown on the home page (run it periodically)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--count',
+            type=int,
+            default=FEATURED_COUNT * CANDIDATE_FACTOR,
+            help='Books to rank; more than the home page shows so it stays full as books go out',
+        )
+
+    def handle(self, *args, **options):
+        if options['count'] < 1:
+            raise CommandError('--count must be positive')
+        started = time.monotonic()
+        ranked = refresh_featured_books(options['count'])
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f'Ranked {ranked} featured books in {elapsed:.1f}s'))
@@ -0,0 +1,370 @@
+import atexit
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import ctypes
+    import msvcrt
+
+from django.conf import settings
+
+# Directory shared by all worker processes. Each process writes its values
+# to metrics-<pid>-<id>.json there and a scrape adds them up; the files of
+# processes that have exited are folded into metrics-archive.json, so
+# counters keep their totals. Unset, only the scraped process's own values
+# are reported.
+METRICS_DIR = getattr(settings, 'BOOKS_METRICS_DIR', None)
+# Longest a process keeps updates to itself before writing its file
+FLUSH_INTERVAL = getattr(settings, 'BOOKS_METRICS_FLUSH_INTERVAL', 1.0)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _file_pid(name):
+    """The process id in a metrics-<pid>-<id>.json file name, or None."""
+    if not (name.startswith('metrics-') and name.endswith('.json')):
+        return None
+    pid = name[len('metrics-'):-len('.json')].split('-')[0]
+    return int(pid) if pid.isdigit() else None
+
+
+if os.name == 'nt':
+    _kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+    PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+    STILL_ACTIVE = 259
+    ERROR_ACCESS_DENIED = 5
+
+    def _alive(pid):
+        # os.kill(pid, 0) would send CTRL_C_EVENT here
+        handle = _kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle:
+            # Someone else's process still exists
+            return ctypes.get_last_error() == ERROR_ACCESS_DENIED
+        try:
+            code = ctypes.c_ulong()
+            if not _kernel32.GetExitCodeProcess(handle, ctypes.byref(code)):
+                return True
+            return code.value == STILL_ACTIVE
+        finally:
+            _kernel32.CloseHandle(handle)
+else:
+    def _alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            # Someone else's process
+            return True
+        return True
+
+
+@contextmanager
+def _locked(path):
+    """Hold an exclusive lock on the file at ``path``."""
+    with open(path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+            return
+        # Locks the first byte; msvcrt.locking retries for up to 10 seconds
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.registry = registry or REGISTRY
+        self.registry.register(self)
+
+    def _labels(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def empty(self):
+        raise NotImplementedError
+
+    def merge(self, total, value):
+        raise NotImplementedError
+
+    def samples(self, labels, value):
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._labels(labels)
+
+        def update(values):
+            values[key] = values.get(key, 0) + amount
+        self.registry.update(self, update)
+
+    def empty(self):
+        return 0
+
+    def merge(self, total, value):
+        return total + value
+
+    def samples(self, labels, value):
+        yield self.name, _format_labels(self.labelnames, labels), value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, **labels):
+        key = self._labels(labels)
+        # Per-bucket counts (not cumulative), then sum and count
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+
+        def update(values):
+            state = values.get(key)
+            if state is None:
+                state = values[key] = self.empty()
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+        self.registry.update(self, update)
+
+    def empty(self):
+        return [0] * (len(self.buckets) + 1) + [0.0, 0]
+
+    def merge(self, total, value):
+        return [a + b for a, b in zip(total, value)]
+
+    def samples(self, labels, value):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), value):
+            cumulative += count
+            le = (('le', _format_value(bound)),)
+            yield f'{self.name}_bucket', _format_labels(self.labelnames, labels, le), cumulative
+        yield f'{self.name}_sum', _format_labels(self.labelnames, labels), value[-2]
+        yield f'{self.name}_count', _format_labels(self.labelnames, labels), value[-1]
+
+
+class Registry:
+    """
+    Metrics of this process, optionally shared with the other worker
+    processes through files in ``directory``.
+    """
+
+    def __init__(self, directory=METRICS_DIR, flush_interval=FLUSH_INTERVAL):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.metrics = {}
+        self.values = {}
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.file_id = None
+        self.last_flush = 0.0
+        self.dirty = False
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f'Metric {metric.name} is already registered')
+        self.metrics[metric.name] = metric
+        self.values[metric.name] = {}
+
+    def _check_pid(self):
+        # Called with the lock held
+        if os.getpid() != self.pid:
+            # Forked worker: the values so far belong to the parent
+            self.pid = os.getpid()
+            self.file_id = None
+            for values in self.values.values():
+                values.clear()
+
+    def update(self, metric, update):
+        flush = False
+        with self.lock:
+            self._check_pid()
+            update(self.values[metric.name])
+            self.dirty = True
+            if self.directory and time.monotonic() - self.last_flush >= self.flush_interval:
+                flush = True
+        if flush:
+            self.flush()
+
+    def snapshot(self):
+        with self.lock:
+            self._check_pid()
+            return {
+                name: [[list(labels), value] for labels, value in values.items()]
+                for name, values in self.values.items()
+            }
+
+    def _filename(self):
+        if self.file_id is None:
+            # A process id can be reused once its process exits; the id
+            # keeps a new process from writing over the old one's file
+            self.file_id = uuid.uuid4().hex[:12]
+        return f'metrics-{self.pid}-{self.file_id}.json'
+
+    def _write(self, path, snapshot):
+        tmp_path = f'{path}.{self.pid}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, path)
+
+    def _read(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def flush(self):
+        """Write this process's values to its file in the shared directory."""
+        if not self.directory:
+            return
+        with self.lock:
+            self._check_pid()
+            if not self.dirty:
+                return
+            self.dirty = False
+            self.last_flush = time.monotonic()
+            filename = self._filename()
+        snapshot = self.snapshot()
+        os.makedirs(self.directory, exist_ok=True)
+        self._write(os.path.join(self.directory, filename), snapshot)
+
+    def prune(self):
+        """
+        Fold the files of processes that have exited into the archive file
+        and remove them.
+        """
+        if not os.path.isdir(self.directory):
+            return
+        own = self._filename()
+        # One process prunes at a time, so no archive update is lost
+        with _locked(os.path.join(self.directory, 'metrics.lock')):
+            dead = []
+            for name in os.listdir(self.directory):
+                pid = _file_pid(name)
+                if pid is None or name == own:
+                    continue
+                # A file with our pid but another id was left by an exited process
+                if pid == self.pid or not _alive(pid):
+                    dead.append(os.path.join(self.directory, name))
+            if not dead:
+                return
+            archive_path = os.path.join(self.directory, 'metrics-archive.json')
+            snapshots = [self._read(path) for path in [archive_path] + dead]
+            totals = self._merge(snapshot for snapshot in snapshots if snapshot)
+            self._write(archive_path, {
+                name: [[list(labels), value] for labels, value in values.items()]
+                for name, values in totals.items()
+            })
+            for path in dead:
+                os.remove(path)
+
+    def _merge(self, snapshots):
+        totals = {name: {} for name in self.metrics}
+        for snapshot in snapshots:
+            for name, entries in snapshot.items():
+                metric = self.metrics.get(name)
+                if metric is None:
+                    continue
+                for labels, value in entries:
+                    labels = tuple(labels)
+                    totals[name][labels] = metric.merge(totals[name].get(labels, metric.empty()), value)
+        return totals
+
+    def collect(self):
+        """Values summed over every process, as ``{name: {labels: value}}``."""
+        snapshots = []
+        if self.directory:
+            self.flush()
+            self.prune()
+            if os.path.isdir(self.directory):
+                for name in os.listdir(self.directory):
+                    if name.startswith('metrics-') and name.endswith('.json'):
+                        snapshot = self._read(os.path.join(self.directory, name))
+                        if snapshot is not None:
+                            snapshots.append(snapshot)
+        else:
+            snapshots.append(self.snapshot())
+        return self._merge(snapshots)
+
+    def exposition(self):
+        """Every metric in the Prometheus text format (version 0.0.4)."""
+        lines = []
+        for name, values in sorted(self.collect().items()):
+            metric = self.metrics[name]
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            for labels, value in sorted(values.items()):
+                for sample, label_text, sample_value in metric.samples(labels, value):
+                    lines.append(f'{sample}{label_text} {_format_value(sample_value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+# Updates made within FLUSH_INTERVAL of exiting would otherwise be lost
+atexit.register(REGISTRY.flush)
+
+VIEW_LATENCY = Histogram(
+    'bookcycle_view_duration_seconds',
+    'Time spent serving a request, by URL name.',
+    ['view', 'method', 'status'],
+)
+INVENTORY_OPERATIONS = Counter(
+    'bookcycle_inventory_operations_total',
+    'Borrow, rent, purchase and return attempts by outcome.',
+    ['operation', 'outcome'],
+)
+REVIEW_WRITES = Counter(
+    'bookcycle_review_writes_total',
+    'Reviews created, updated, deleted or bulk imported.',
+    ['action'],
+)
+CACHE_REQUESTS = Counter(
+    'bookcycle_cache_requests_total',
+    'Cache lookups by cache and result.',
+    ['cache', 'result'],
+)
+COVER_DOWNLOADS = Counter(
+    'bookcycle_cover_downloads_total',
+    'Books handled by download_book_covers, by outcome.',
+    ['outcome'],
+)
@@ -0,0 +1,308 @@
+import cProfile
+import datetime
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .metrics import VIEW_LATENCY
+
+logger = logging.getLogger('books.sql')
+
+# Fraction of requests instrumented; 0 turns the middleware off
+SQL_SAMPLE_RATE = getattr(settings, 'BOOKS_SQL_SAMPLE_RATE', 1.0 if settings.DEBUG else 0.05)
+# Same-shape queries in one request from which we call it a likely N+1
+N_PLUS_ONE_THRESHOLD = getattr(settings, 'BOOKS_SQL_N_PLUS_ONE_THRESHOLD', 5)
+# Requests with more queries than this are logged at WARNING as well
+SQL_QUERY_BUDGET = getattr(settings, 'BOOKS_SQL_QUERY_BUDGET', 50)
+# Repeated shapes included in each log record
+REPORTED_SHAPES = 5
+
+_IN_LIST = re.compile(r'\bIN \((?:\?, )*\?\)', re.IGNORECASE)
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+
+
+def query_shape(sql):
+    """``sql`` with literals and IN lists collapsed, so queries that differ only in values compare equal."""
+    sql = _STRING.sub('?', sql).replace('%s', '?')
+    sql = _NUMBER.sub('?', sql)
+    return _IN_LIST.sub('IN (...)', sql)
+
+
+class QueryRecorder:
+    """execute_wrapper that tallies the queries of one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = defaultdict(lambda: [0, 0.0])
+        self.exact = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.duration += elapsed
+            shape = self.shapes[query_shape(sql)]
+            shape[0] += 1
+            shape[1] += elapsed
+            self.exact[(sql, repr(params))] += 1
+
+    def repeated_shapes(self, threshold):
+        return sorted(
+            ((sql, count, duration) for sql, (count, duration) in self.shapes.items() if count >= threshold),
+            key=lambda item: (-item[1], -item[2]),
+        )
+
+    @property
+    def duplicates(self):
+        """Queries run more than once with exactly the same parameters."""
+        return sum(count - 1 for count in self.exact.values() if count > 1)
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Count the SQL queries of a sample of requests and report them in a
+    ``Server-Timing`` header and one JSON log record per request on the
+    ``books.sql`` logger. Queries sharing a shape BOOKS_SQL_N_PLUS_ONE_THRESHOLD
+    or more times are reported as likely N+1s and logged at WARNING.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not SQL_SAMPLE_RATE or random.random() >= SQL_SAMPLE_RATE:
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        n_plus_one = recorder.repeated_shapes(N_PLUS_ONE_THRESHOLD)
+        timing = f'sql;dur={recorder.duration * 1000:.2f};desc="{recorder.count} queries"'
+        if n_plus_one:
+            timing += f', sql-repeated;desc="{len(n_plus_one)} repeated shapes"'
+        response['Server-Timing'] = ', '.join(filter(None, [response.get('Server-Timing'), timing]))
+
+        match = getattr(request, 'resolver_match', None)
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'duration_ms': round(elapsed * 1000, 2),
+            'queries': recorder.count,
+            'sql_ms': round(recorder.duration * 1000, 2),
+            'duplicates': recorder.duplicates,
+            'n_plus_one': [
+                {'count': count, 'sql_ms': round(duration * 1000, 2), 'sql': sql[:500]}
+                for sql, count, duration in n_plus_one[:REPORTED_SHAPES]
+            ],
+        }
+        level = logging.WARNING if n_plus_one or recorder.count > SQL_QUERY_BUDGET else logging.INFO
+        logger.log(level, json.dumps(record), extra={'sql': record})
+        return response
+
+
+profile_logger = logging.getLogger('books.profile')
+
+# Where profiles are written; profiling is off while this is unset
+PROFILE_DIR = getattr(settings, 'BOOKS_PROFILE_DIR', None)
+# Fraction of requests profiled with the sampler, without any header
+PROFILE_SAMPLE_RATE = getattr(settings, 'BOOKS_PROFILE_SAMPLE_RATE', 0)
+# Interval of the statistical sampler, in seconds
+PROFILE_INTERVAL = getattr(settings, 'BOOKS_PROFILE_INTERVAL', 0.005)
+# Oldest profiles are deleted beyond either limit
+PROFILE_MAX_FILES = getattr(settings, 'BOOKS_PROFILE_MAX_FILES', 200)
+PROFILE_MAX_BYTES = getattr(settings, 'BOOKS_PROFILE_MAX_BYTES', 100 * 1024 * 1024)
+# How long a signed X-Profile-Token stays valid, in seconds
+PROFILE_TOKEN_MAX_AGE = getattr(settings, 'BOOKS_PROFILE_TOKEN_MAX_AGE', 3600)
+PROFILE_MODES = ('cprofile', 'sample')
+PROFILE_SALT = 'books.profile'
+
+# Profilers can't nest, and one at a time bounds the overhead
+_profile_lock = threading.Lock()
+
+
+def profile_token(mode='cprofile'):
+    """Signed value for the X-Profile-Token header that profiles one request with ``mode``."""
+    if mode not in PROFILE_MODES:
+        raise ValueError(f'Unknown profile mode {mode!r}')
+    return signing.TimestampSigner(salt=PROFILE_SALT).sign(mode)
+
+
+class StackSampler:
+    """
+    Statistical profiler: a background thread snapshots the stack of one
+    thread every ``interval`` seconds and counts collapsed stacks, in the
+    format flamegraph.pl and speedscope read.
+    """
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='books-profile-sampler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_filename}:{code.co_name}:{frame.f_lineno}')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+class ProfilingMiddleware:
+    """
+    Profile a request and write the result to BOOKS_PROFILE_DIR, either
+    for a BOOKS_PROFILE_SAMPLE_RATE fraction of requests with the cheap
+    statistical sampler (``.collapsed`` stacks), or on demand for requests
+    carrying an ``X-Profile-Token`` from profile_token() (``.prof`` from
+    cProfile, or ``.collapsed`` for a ``sample`` token).
+
+    Only one request per process is profiled at a time, and the directory
+    is pruned to BOOKS_PROFILE_MAX_FILES / BOOKS_PROFILE_MAX_BYTES.
+    """
+
+    def __init__(self, get_response):
+        if not PROFILE_DIR:
+            raise MiddlewareNotUsed
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        self.get_response = get_response
+
+    def profile_mode(self, request):
+        token = request.headers.get('X-Profile-Token')
+        if token:
+            try:
+                mode = signing.TimestampSigner(salt=PROFILE_SALT).unsign(token, max_age=PROFILE_TOKEN_MAX_AGE)
+            except signing.BadSignature:
+                profile_logger.warning('Ignoring invalid X-Profile-Token on %s', request.path)
+                return None
+            return mode if mode in PROFILE_MODES else None
+        if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+            return 'sample'
+        return None
+
+    def __call__(self, request):
+        mode = self.profile_mode(request)
+        if mode is None or not _profile_lock.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            return self.profile(request, mode)
+        finally:
+            _profile_lock.release()
+
+    def profile(self, request, mode):
+        if mode == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            profiler = StackSampler(threading.get_ident())
+            profiler.start()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            elapsed = time.perf_counter() - started
+            if mode == 'cprofile':
+                profiler.disable()
+            else:
+                profiler.stop()
+        if mode == 'sample' and not profiler.stacks:
+            # Finished before the first sample
+            return response
+
+        match = getattr(request, 'resolver_match', None)
+        view = (match.view_name if match else 'unresolved').replace(':', '.')
+        stamp = datetime.datetime.now().strftime('%Y%m%dT%H%M%S%f')
+        suffix = 'prof' if mode == 'cprofile' else 'collapsed'
+        name = f'{stamp}-{os.getpid()}-{view}-{elapsed * 1000:.0f}ms.{suffix}'
+        path = os.path.join(PROFILE_DIR, name)
+        try:
+            if mode == 'cprofile':
+                profiler.dump_stats(path)
+            else:
+                profiler.write(path)
+            prune_profiles(PROFILE_DIR)
+        except OSError as e:
+            profile_logger.warning('Could not write profile %s: %s', path, e)
+            return response
+
+        profile_logger.info('Profiled %s %s in %.1f ms: %s', request.method, request.path, elapsed * 1000, name)
+        response['X-Profile-File'] = name
+        return response
+
+
+def prune_profiles(directory, max_files=PROFILE_MAX_FILES, max_bytes=PROFILE_MAX_BYTES):
+    """Delete the oldest profiles in ``directory`` until both limits hold."""
+    profiles = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith(('.prof', '.collapsed')):
+                stat = entry.stat()
+                profiles.append((stat.st_mtime, stat.st_size, entry.path))
+    profiles.sort()
+    total = sum(size for _, size, _ in profiles)
+    while profiles and (len(profiles) > max_files or total > max_bytes):
+        _, size, path = profiles.pop(0)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+class MetricsMiddleware:
+    """Record the latency of every request in VIEW_LATENCY, by URL name, method and status class."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        VIEW_LATENCY.observe(
+            time.perf_counter() - started,
+            view=match.view_name if match else 'unresolved',
+            method=request.method,
+            status=f'{response.status_code // 100}xx',
+        )
+        return response
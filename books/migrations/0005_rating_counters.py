@@ -0,0 +1,42 @@
+# Generated by Django 5.0.2 on 2026-10-18 06:26
+
+from django.db import migrations, models
+
+
+def backfill_rating_counters(apps, schema_editor):
+    Book = apps.get_model('books', 'Book')
+    Review = apps.get_model('books', 'Review')
+    totals = (
+        Review.objects.order_by()
+        .values_list('book_id')
+        .annotate(rating_sum=models.Sum('rating'), rating_count=models.Count('id'))
+    )
+    Book.objects.bulk_update(
+        [
+            Book(pk=book_id, rating_sum=rating_sum, rating_count=rating_count)
+            for book_id, rating_sum, rating_count in totals
+        ],
+        ['rating_sum', 'rating_count'],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0004_catalog_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='rating_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_sum',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_rating_counters, migrations.RunPython.noop),
+    ]
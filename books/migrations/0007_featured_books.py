@@ -0,0 +1,26 @@
+# Generated by Django 5.0.2 on 2026-10-18 06:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0006_book_cover_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeaturedBook',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField(unique=True)),
+                ('reason', models.CharField(choices=[('new', 'Recently added'), ('top_rated', 'Highly rated')], max_length=20)),
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='featured', to='books.book')),
+            ],
+            options={
+                'ordering': ['position'],
+            },
+        ),
+    ]
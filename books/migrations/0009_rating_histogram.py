@@ -0,0 +1,58 @@
+# Generated by Django 5.0.2 on 2026-10-18 06:48
+
+from django.db import migrations, models
+
+
+def backfill_rating_histogram(apps, schema_editor):
+    Book = apps.get_model('books', 'Book')
+    Review = apps.get_model('books', 'Review')
+    fields = [f'rating_{stars}' for stars in range(1, 6)]
+    counts = (
+        Review.objects.order_by()
+        .values_list('book_id')
+        .annotate(**{
+            field: models.Count('id', filter=models.Q(rating=stars))
+            for stars, field in enumerate(fields, start=1)
+        })
+    )
+    Book.objects.bulk_update(
+        [Book(pk=book_id, **dict(zip(fields, stars_counts))) for book_id, *stars_counts in counts],
+        fields,
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0008_review_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='rating_1',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_2',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_3',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_4',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_5',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_rating_histogram, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,8 @@
-from django.db import models
+from django.db import models, transaction
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.utils.text import slugify
 from users.models import CustomUser
+from .metrics import REVIEW_WRITES
+from .slugs import save_with_unique_slug
 
 class Category(models.Model):
     name = models.CharField(max_length=100)
@@ -14,12 +15,56 @@ class Category(models.Model):
 
     def save(self, *args, **kwargs):
         if not self.slug:
-            self.slug = slugify(self.name)
+            return save_with_unique_slug(self, self.name, super().save, *args, **kwargs)
         super().save(*args, **kwargs)
 
     def __str__(self):
         return self.name
 
+class BookQuerySet(models.QuerySet):
+    # Catalog availability filter values mapped to the statuses they cover
+    AVAILABILITY_FILTERS = {
+        'available': ['available'],
+        'borrowed': ['borrowed', 'rented'],
+    }
+
+    # Every ordering ends in a unique id tiebreaker so it is total and can
+    # drive keyset pagination.
+    SORT_ORDERINGS = {
+        'newest': ('-created_at', '-id'),
+        'rating': ('-rating', '-id'),
+        'title': ('title', 'id'),
+        'popular': ('-total_reviews', '-id'),
+        'relevance': ('-search_rank', 'id'),
+    }
+
+    def available(self):
+        return self.filter(availability_status='available')
+
+    def filter_catalog(self, category=None, search=None, availability=None):
+        books = self
+        if category:
+            books = books.filter(category__slug=category)
+        if search:
+            books = books.search(search)
+        if availability in self.AVAILABILITY_FILTERS:
+            books = books.filter(availability_status__in=self.AVAILABILITY_FILTERS[availability])
+        return books
+
+    def search(self, query):
+        from .search import get_backend
+
+        # search_rank carries the backend's relevance score for sort=relevance
+        return get_backend().filter_books(self, query)
+
+    def sort_catalog(self, sort):
+        if sort == 'relevance' and 'search_rank' not in self.query.annotations:
+            # No search to rank by
+            sort = 'newest'
+        if sort in self.SORT_ORDERINGS:
+            return self.order_by(*self.SORT_ORDERINGS[sort])
+        return self
+
 class Book(models.Model):
     AVAILABILITY_CHOICES = [
         ('available', 'Available'),
@@ -35,6 +80,8 @@ class Book(models.Model):
     description = models.TextField()
     isbn = models.CharField(max_length=13, unique=True)
     cover_image = models.ImageField(upload_to='book_covers/')
+    # SHA-256 of the cover file; names its resized variants (see books.covers)
+    cover_hash = models.CharField(max_length=64, blank=True)
     publication_date = models.DateField()
     publisher = models.CharField(max_length=200)
     pages = models.IntegerField()
@@ -47,11 +94,67 @@ class Book(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     rating = models.DecimalField(max_digits=3, decimal_places=2, default=0.00)
     total_reviews = models.IntegerField(default=0)
+    # Running totals of Review.rating; rating and total_reviews are derived
+    # from them (see books.ratings).
+    rating_sum = models.IntegerField(default=0)
+    rating_count = models.IntegerField(default=0)
+    # Number of reviews with each star rating
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+
+    HISTOGRAM_FIELDS = {stars: f'rating_{stars}' for stars in range(1, 6)}
+
+    objects = BookQuerySet.as_manager()
+
+    class Meta:
+        # Shaped after the catalog queries in views.py: home filters on
+        # availability, book_list filters on category and availability and
+        # orders by one of BookQuerySet.SORT_ORDERINGS.
+        indexes = [
+            models.Index(fields=['availability_status', '-created_at', '-id'], name='book_avail_created_idx'),
+            models.Index(fields=['category', 'availability_status', 'language'], name='book_facet_idx'),
+            models.Index(fields=['category', 'availability_status', '-created_at', '-id'], name='book_cat_avail_created_idx'),
+            models.Index(fields=['category', 'availability_status', '-rating', '-id'], name='book_cat_avail_rating_idx'),
+            models.Index(fields=['category', 'availability_status', 'title', 'id'], name='book_cat_avail_title_idx'),
+            models.Index(fields=['category', 'availability_status', '-total_reviews', '-id'], name='book_cat_avail_popular_idx'),
+            models.Index(fields=['-created_at', '-id'], name='book_created_idx'),
+            models.Index(fields=['-rating', '-id'], name='book_rating_idx'),
+            models.Index(fields=['title', 'id'], name='book_title_idx'),
+            models.Index(fields=['-total_reviews', '-id'], name='book_popular_idx'),
+            # Incremental exports and the autocomplete catch-up
+            models.Index(fields=['updated_at'], name='book_updated_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        book = super().from_db(db, field_names, values)
+        # Remember the stored cover so save() can tell when it is replaced
+        if 'cover_image' in field_names and 'cover_hash' in field_names:
+            book._stored_cover = (book.cover_image.name, book.cover_hash)
+        return book
 
     def save(self, *args, **kwargs):
+        stored = getattr(self, '_stored_cover', None)
+        if stored is not None and self.cover_image.name != stored[0] and self.cover_hash == stored[1]:
+            # The variants were made from the old file; cover_url falls back
+            # to the new one until generate_cover_variants runs again.
+            self.cover_hash = ''
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'cover_hash' not in update_fields:
+                kwargs['update_fields'] = [*update_fields, 'cover_hash']
         if not self.slug:
-            self.slug = slugify(self.title)
-        super().save(*args, **kwargs)
+            save_with_unique_slug(self, self.title, super().save, *args, **kwargs)
+        else:
+            super().save(*args, **kwargs)
+        self._stored_cover = (self.cover_image.name, self.cover_hash)
+
+    def cover_url(self, variant='card', image_format='jpeg'):
+        from .covers import cover_url
+
+        return cover_url(self, variant, image_format)
 
     def is_available(self):
         return self.availability_status == 'available'
@@ -60,12 +163,25 @@ class Book(models.Model):
         return self.title
 
     def update_rating(self):
-        reviews = self.reviews.all()
-        if reviews:
-            avg_rating = reviews.aggregate(models.Avg('rating'))['rating__avg']
-            self.rating = round(avg_rating, 2)
-            self.total_reviews = reviews.count()
-            self.save()
+        from .ratings import recompute_ratings
+
+        recompute_ratings(Book.objects.filter(pk=self.pk))
+        self.refresh_from_db(fields=[
+            'rating', 'total_reviews', 'rating_sum', 'rating_count', *self.HISTOGRAM_FIELDS.values(),
+        ])
+
+    @property
+    def rating_histogram(self):
+        """Review counts and shares per star rating, five stars first."""
+        histogram = []
+        for stars in range(5, 0, -1):
+            count = getattr(self, self.HISTOGRAM_FIELDS[stars])
+            histogram.append({
+                'stars': stars,
+                'count': count,
+                'percent': round(100 * count / self.rating_count) if self.rating_count else 0,
+            })
+        return histogram
 
 class Review(models.Model):
     book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='reviews')
@@ -77,10 +193,71 @@ class Review(models.Model):
 
     class Meta:
         unique_together = ('book', 'user')
+        # Review feeds on book_detail, see books.reviews.REVIEW_SORTS
+        indexes = [
+            models.Index(fields=['book', '-created_at', '-id'], name='review_book_created_idx'),
+            models.Index(fields=['book', '-rating', '-created_at', '-id'], name='review_book_rating_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username}'s review of {self.book.title}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        review = super().from_db(db, field_names, values)
+        # Remember the stored rating so an edit can apply just the difference
+        review._stored_rating = review.rating if 'rating' in field_names else None
+        return review
+
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        self.book.update_rating()
+        from .ratings import apply_review_delta
+
+        adding = self._state.adding
+        stored_rating = getattr(self, '_stored_rating', None)
+        if not adding and stored_rating is None:
+            stored_rating = Review.objects.filter(pk=self.pk).values_list('rating', flat=True).first()
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding or stored_rating is None:
+                apply_review_delta(self.book_id, added=self.rating)
+            elif self.rating != stored_rating:
+                apply_review_delta(self.book_id, added=self.rating, removed=stored_rating)
+        REVIEW_WRITES.inc(action='create' if adding else 'update')
+        self._stored_rating = self.rating
+
+
+class SearchDocument(models.Model):
+    book = models.OneToOneField(Book, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+    length = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Search document for {self.book_id}"
+
+class SearchPosting(models.Model):
+    term = models.CharField(max_length=64)
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='search_postings')
+    frequency = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('term', 'book')
+
+    def __str__(self):
+        return f"{self.term} in {self.book_id}"
+
+class FeaturedBook(models.Model):
+    """Precomputed home page ranking, rebuilt by refresh_featured_books."""
+
+    REASON_CHOICES = [
+        ('new', 'Recently added'),
+        ('top_rated', 'Highly rated'),
+    ]
+
+    book = models.OneToOneField(Book, on_delete=models.CASCADE, related_name='featured')
+    position = models.PositiveIntegerField(unique=True)
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES)
+
+    class Meta:
+        ordering = ['position']
+
+    def __str__(self):
+        return f"#{self.position} {self.book_id} ({self.reason})"
@@ -0,0 +1,162 @@
+import base64
+import datetime
+import decimal
+import json
+from functools import reduce
+from operator import and_, or_
+
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorEncoder(json.JSONEncoder):
+    # Unlike DjangoJSONEncoder this keeps microseconds, which the cursor
+    # needs to land exactly between two rows.
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.date, datetime.time)):
+            return o.isoformat()
+        if isinstance(o, decimal.Decimal):
+            return str(o)
+        return super().default(o)
+
+
+def _parse_ordering(ordering):
+    return [(field.lstrip('-'), field.startswith('-')) for field in ordering]
+
+
+class KeysetPage:
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return f'<KeysetPage of {len(self.object_list)} items>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if not self._has_next or not self.object_list:
+            return None
+        return self.paginator.encode_cursor(self.object_list[-1], 'next')
+
+    @property
+    def previous_cursor(self):
+        if not self._has_previous or not self.object_list:
+            return None
+        return self.paginator.encode_cursor(self.object_list[0], 'prev')
+
+    @property
+    def total_count(self):
+        return self.paginator.count
+
+
+class KeysetPaginator:
+    """
+    Cursor-based paginator for a queryset with a total ``ordering``.
+
+    The last ordering field must be unique (normally ``id``) so that the
+    cursor pins down an exact position. Every page is fetched with a
+    ``WHERE (sort key) > (cursor)`` predicate and a ``LIMIT``, so the cost
+    does not grow with the page depth and no ``COUNT(*)`` is issued. The
+    optional ``count`` (a number or a callable) is only reported back for
+    display, e.g. the cached facet total.
+    """
+
+    def __init__(self, queryset, ordering, per_page, count=None):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.fields = _parse_ordering(self.ordering)
+        self.per_page = per_page
+        self._count = count
+
+    @property
+    def count(self):
+        if callable(self._count):
+            self._count = self._count()
+        return self._count
+
+    def encode_cursor(self, obj, direction):
+        values = [getattr(obj, name) for name, descending in self.fields]
+        payload = json.dumps({'k': values, 'd': direction}, cls=CursorEncoder)
+        return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+            direction = payload['d']
+            raw_values = payload['k']
+            if direction not in ('next', 'prev') or len(raw_values) != len(self.fields):
+                raise InvalidCursor(cursor)
+            model = self.queryset.model
+            values = [
+                model._meta.get_field(name).to_python(value)
+                for (name, descending), value in zip(self.fields, raw_values)
+            ]
+        except InvalidCursor:
+            raise
+        except Exception as e:
+            raise InvalidCursor(cursor) from e
+        return values, direction
+
+    def _after(self, values, reverse):
+        # (a, b, c) > (x, y, z) expanded into
+        # a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z)
+        clauses = []
+        for position, (name, descending) in enumerate(self.fields):
+            lookup = 'lt' if descending != reverse else 'gt'
+            equal = [Q(**{field: value}) for (field, _), value in zip(self.fields[:position], values)]
+            clauses.append(reduce(and_, equal + [Q(**{f'{name}__{lookup}': values[position]})]))
+        return reduce(or_, clauses)
+
+    def get_page(self, cursor=None):
+        """
+        Return the page after/before ``cursor``. Bad cursors, and cursors
+        past either end (stale or bookmarked ones), give page one.
+        """
+        direction = 'next'
+        queryset = self.queryset.order_by(*self.ordering)
+        if cursor:
+            try:
+                values, direction = self.decode_cursor(cursor)
+            except InvalidCursor:
+                cursor = None
+            else:
+                if direction == 'prev':
+                    reversed_ordering = [
+                        name if descending else f'-{name}' for name, descending in self.fields
+                    ]
+                    queryset = self.queryset.order_by(*reversed_ordering)
+                queryset = queryset.filter(self._after(values, reverse=direction == 'prev'))
+
+        rows = list(queryset[:self.per_page + 1])
+        if cursor and not rows:
+            return self.get_page()
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if direction == 'prev':
+            rows.reverse()
+            return KeysetPage(rows, self, has_next=True, has_previous=has_more)
+        return KeysetPage(rows, self, has_next=has_more, has_previous=bool(cursor))
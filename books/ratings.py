@@ -0,0 +1,199 @@
+import threading
+from contextlib import contextmanager
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce, Greatest, Round
+from django.db.models.lookups import GreaterThan
+from django.utils import timezone
+
+from .models import Book, Review
+from .signals import RATING_FIELDS, notify_books_updated
+
+
+# Chunk size for the book ids recomputed after a deferred block
+RECOMPUTE_BATCH_SIZE = 500
+
+CENT = Decimal('0.01')
+# The database rounds a float average, which can land one cent away from
+# the exact decimal on ties; reconcile_ratings does not count that as drift.
+RATING_TOLERANCE = CENT
+
+_deferred = threading.local()
+
+
+def rating_expression(rating_sum, rating_count):
+    """SQL for round(rating_sum / rating_count, 2), or 0 without reviews."""
+    # Float arithmetic avoids integer division; the cast back to decimal
+    # lets Postgres round it.
+    average = Cast(
+        rating_sum * Value(1.0) / rating_count,
+        DecimalField(max_digits=12, decimal_places=4),
+    )
+    return Case(
+        When(GreaterThan(rating_count, 0), then=Round(average, 2)),
+        default=Value(Decimal('0.00')),
+        output_field=DecimalField(max_digits=3, decimal_places=2),
+    )
+
+
+def apply_review_delta(book_id, added=None, removed=None):
+    """
+    Account for a review rated ``added`` stars appearing and/or one rated
+    ``removed`` stars going away (both for an edit): shift the book's
+    running rating sum, count and star histogram and re-derive rating and
+    total_reviews from them in one UPDATE, whatever the number of reviews.
+
+    Inside defer_rating_updates() the book is only recorded for a single
+    recomputation when the block exits.
+    """
+    pending = getattr(_deferred, 'books', None)
+    if pending is not None:
+        pending.add(book_id)
+        return
+    sum_delta = (added or 0) - (removed or 0)
+    count_delta = (added is not None) - (removed is not None)
+    histogram = {}
+    if added != removed:
+        if added is not None:
+            field = Book.HISTOGRAM_FIELDS[added]
+            histogram[field] = F(field) + 1
+        if removed is not None:
+            field = Book.HISTOGRAM_FIELDS[removed]
+            # Never below zero: a drifted counter would otherwise fail the
+            # column's CHECK constraint; reconcile_ratings repairs it.
+            histogram[field] = Greatest(F(field) - 1, 0)
+    rating_sum = F('rating_sum') + sum_delta
+    rating_count = F('rating_count') + count_delta
+    # Derived columns come first so that on MySQL, which evaluates SET
+    # clauses left to right, they still see the old counters.
+    Book.objects.filter(pk=book_id).update(
+        rating=rating_expression(rating_sum, rating_count),
+        total_reviews=rating_count,
+        rating_sum=rating_sum,
+        rating_count=rating_count,
+        **histogram,
+        updated_at=timezone.now(),
+    )
+    notify_books_updated([book_id], RATING_FIELDS)
+
+
+def recompute_ratings(books):
+    """
+    Recompute the rating columns of every Book in ``books`` from its
+    reviews with a single UPDATE over correlated aggregates.
+    """
+    reviews = Review.objects.filter(book=OuterRef('pk')).order_by().values('book')
+    rating_sum = Coalesce(Subquery(reviews.annotate(total=Sum('rating')).values('total')), 0)
+    rating_count = Coalesce(Subquery(reviews.annotate(count=Count('id')).values('count')), 0)
+    histogram = {
+        field: Coalesce(Subquery(reviews.filter(rating=stars).annotate(count=Count('id')).values('count')), 0)
+        for stars, field in Book.HISTOGRAM_FIELDS.items()
+    }
+    return books.order_by().update(
+        rating=rating_expression(rating_sum, rating_count),
+        total_reviews=rating_count,
+        rating_sum=rating_sum,
+        rating_count=rating_count,
+        **histogram,
+        updated_at=timezone.now(),
+    )
+
+
+def reconcile_ratings(batch_size=1000, dry_run=False):
+    """
+    Compare every Book's rating counters and star histogram with its
+    reviews and rewrite the rows that drifted. Books are walked in pk
+    order, ``batch_size`` at a time, each batch checked against one
+    GROUP BY over its pk range and fixed in its own transaction, so memory
+    and lock time stay bounded on a large catalog.
+
+    Returns ``(checked, fixed)``.
+    """
+    histogram_fields = list(Book.HISTOGRAM_FIELDS.values())
+    update_fields = ['rating', 'total_reviews', 'rating_sum', 'rating_count', *histogram_fields, 'updated_at']
+    stars_counts = {
+        field: Count('id', filter=Q(rating=stars)) for stars, field in Book.HISTOGRAM_FIELDS.items()
+    }
+    no_reviews = [0] * (2 + len(histogram_fields))
+    books = Book.objects.order_by('pk').values_list(
+        'pk', 'rating', 'total_reviews', 'rating_sum', 'rating_count', *histogram_fields,
+    )
+
+    checked = 0
+    fixed = 0
+    last_pk = None
+    while True:
+        with transaction.atomic():
+            batch = books if last_pk is None else books.filter(pk__gt=last_pk)
+            batch = list(batch[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+            totals = {
+                book_id: counters
+                for book_id, *counters in Review.objects.filter(book_id__gte=batch[0][0], book_id__lte=last_pk)
+                .order_by()
+                .values_list('book_id')
+                .annotate(rating_sum=Sum('rating'), rating_count=Count('id'), **stars_counts)
+            }
+            now = timezone.now()
+            fixed_ids = []
+            drifted = []
+            for pk, rating, total_reviews, *counters in batch:
+                expected = totals.get(pk, no_reviews)
+                expected_sum, expected_count = expected[:2]
+                expected_rating = (
+                    (Decimal(expected_sum) / expected_count).quantize(CENT, ROUND_HALF_UP)
+                    if expected_count else Decimal('0.00')
+                )
+                if list(counters) == list(expected) and total_reviews == expected_count \
+                        and abs(rating - expected_rating) <= RATING_TOLERANCE:
+                    continue
+                fixed_ids.append(pk)
+                drifted.append(Book(
+                    pk=pk,
+                    rating=expected_rating,
+                    total_reviews=expected_count,
+                    rating_sum=expected_sum,
+                    rating_count=expected_count,
+                    **dict(zip(histogram_fields, expected[2:])),
+                    updated_at=now,
+                ))
+            checked += len(batch)
+            fixed += len(fixed_ids)
+            if drifted and not dry_run:
+                Book.objects.bulk_update(drifted, update_fields)
+                notify_books_updated(fixed_ids, RATING_FIELDS)
+    return checked, fixed
+
+
+@contextmanager
+def defer_rating_updates():
+    """
+    Skip per-review rating updates inside the block and recompute every
+    affected book once at the end, with one aggregated UPDATE per
+    RECOMPUTE_BATCH_SIZE books.
+
+    Reviews saved or deleted one by one are tracked automatically; code
+    that writes reviews with bulk_create() must add the book ids to the
+    yielded set itself. If the block raises, nothing is recomputed and
+    ``reconcile_ratings`` should be run for the books that were touched.
+    """
+    pending = getattr(_deferred, 'books', None)
+    if pending is not None:
+        # Nested block: the outermost one does the recomputation
+        yield pending
+        return
+
+    pending = _deferred.books = set()
+    try:
+        yield pending
+    finally:
+        _deferred.books = None
+
+    book_ids = sorted(pending)
+    for start in range(0, len(book_ids), RECOMPUTE_BATCH_SIZE):
+        recompute_ratings(Book.objects.filter(pk__in=book_ids[start:start + RECOMPUTE_BATCH_SIZE]))
+    notify_books_updated(book_ids, RATING_FIELDS)
@@ -0,0 +1,73 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Review
+from .pagination import KeysetPage, KeysetPaginator
+from .versions import bump_version, get_version
+
+REVIEWS_PER_PAGE = 10
+FIRST_PAGE_CACHE_TIMEOUT = getattr(settings, 'BOOKS_REVIEW_CACHE_TIMEOUT', 3600)
+
+# Each ordering matches one of the Review indexes, read forwards or
+# backwards; "lowest" is the exact reverse of "highest" for that reason.
+REVIEW_SORTS = {
+    'newest': ('-created_at', '-id'),
+    'highest': ('-rating', '-created_at', '-id'),
+    'lowest': ('rating', 'created_at', 'id'),
+}
+
+
+def _version_name(book_id):
+    return f'reviews:{book_id}'
+
+
+def review_version(book_id):
+    """Version of ``book_id``'s reviews, bumped whenever one is saved or deleted."""
+    return get_version(_version_name(book_id))
+
+
+def bump_review_version(book_id):
+    bump_version(_version_name(book_id))
+
+
+def get_review_page(book, sort='newest', cursor=None, per_page=REVIEWS_PER_PAGE):
+    """
+    One page of ``book``'s reviews with their authors, keyset-paginated.
+
+    The first page is cached with the book: its key changes with the
+    book's updated_at and review version.
+    """
+    if sort not in REVIEW_SORTS:
+        sort = 'newest'
+    paginator = KeysetPaginator(
+        Review.objects.filter(book=book).select_related('user'),
+        REVIEW_SORTS[sort],
+        per_page,
+        count=book.total_reviews,
+    )
+    if cursor:
+        return paginator.get_page(cursor)
+
+    key = (
+        f'books:reviews:{book.pk}:{review_version(book.pk)}:'
+        f'{book.updated_at.timestamp()}:{sort}:{per_page}'
+    )
+    cached = cache.get(key)
+    if cached is None:
+        page = paginator.get_page()
+        # Cache the rows, not the page, which holds an unevaluated queryset
+        cache.set(key, (page.object_list, page.has_next()), FIRST_PAGE_CACHE_TIMEOUT)
+        return page
+    rows, has_next = cached
+    return KeysetPage(rows, paginator, has_next=has_next, has_previous=False)
+
+
+def serialize_review(review):
+    return {
+        'id': review.pk,
+        'user': review.user.username,
+        'rating': review.rating,
+        'comment': review.comment,
+        'created_at': review.created_at.isoformat(),
+        'updated_at': review.updated_at.isoformat(),
+    }
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+DEFAULT_BACKEND = 'books.search.backends.database.DatabaseSearchBackend'
+
+_backend = None
+
+
+def get_backend():
+    """Return the configured search backend (``BOOKS_SEARCH_BACKEND``)."""
+    global _backend
+    if _backend is None:
+        backend_class = import_string(getattr(settings, 'BOOKS_SEARCH_BACKEND', DEFAULT_BACKEND))
+        _backend = backend_class()
+    return _backend
@@ -0,0 +1,86 @@
+import re
+import unicodedata
+
+# Relative weight of each Book field when counting term frequencies
+FIELD_WEIGHTS = {
+    'title': 3,
+    'author': 2,
+    'description': 1,
+}
+
+STOPWORDS = frozenset("""
+a an and are as at be by for from has he in is it its of on or she that the
+to was were will with
+""".split())
+
+TOKEN_RE = re.compile(r'\w+')
+
+MAX_TERM_LENGTH = 64
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return text.lower()
+
+
+def _measure(stem):
+    # Number of vowel-consonant sequences, as in Porter's m()
+    return len(re.findall(r'[aeiouy]+[^aeiouy]+', stem))
+
+
+def stem(word):
+    """
+    Light suffix-stripping stemmer modelled on the first steps of Porter's
+    algorithm: it folds plurals and common inflections ("novels",
+    "wars", "ruling", "ruled") onto one term without a dictionary.
+    """
+    if len(word) <= 3 or word.isdigit():
+        return word
+    if word.endswith('sses'):
+        word = word[:-2]
+    elif word.endswith('ies'):
+        word = word[:-2]
+    elif word.endswith('s') and not word.endswith('ss') and not word.endswith('us'):
+        word = word[:-1]
+
+    for suffix in ('ingly', 'edly', 'ing', 'ed'):
+        if word.endswith(suffix):
+            base = word[:-len(suffix)]
+            if re.search(r'[aeiouy]', base) and len(base) > 2:
+                word = base
+                if word[-1] == word[-2] and word[-1] not in 'lsz':
+                    word = word[:-1]
+                elif _measure(word) == 1 and re.search(r'[^aeiou][aeiouy][^aeiouwxy]$', word):
+                    word += 'e'
+            break
+
+    for suffix in ('ational', 'ization', 'fulness', 'iveness', 'ousness', 'ness', 'ment', 'ly'):
+        if word.endswith(suffix) and _measure(word[:-len(suffix)]) > 0:
+            word = word[:-len(suffix)]
+            break
+
+    if word.endswith('y') and len(word) > 3 and word[-2] not in 'aeiou':
+        word = word[:-1] + 'i'
+    return word
+
+
+def analyze(text):
+    """Split ``text`` into normalized, stemmed index terms."""
+    terms = []
+    for token in TOKEN_RE.findall(normalize(text)):
+        if token in STOPWORDS:
+            continue
+        terms.append(stem(token)[:MAX_TERM_LENGTH])
+    return terms
+
+
+def term_frequencies(book):
+    """Return ``({term: weighted frequency}, document length)`` for a Book."""
+    frequencies = {}
+    length = 0
+    for field, weight in FIELD_WEIGHTS.items():
+        for term in analyze(getattr(book, field)):
+            frequencies[term] = frequencies.get(term, 0) + weight
+            length += weight
+    return frequencies, length
@@ -0,0 +1,46 @@
+from django.db import models
+
+
+class BaseSearchBackend:
+    """
+    Interface for catalog search backends.
+
+    Subclasses keep their own index in sync through ``index_book`` and
+    ``remove_book`` (called from the Book signals) and answer queries with
+    ``search``, which returns ``(book_id, score)`` pairs, best match first.
+    A backend built on SQLite FTS5 or a Postgres tsvector column only has
+    to implement these four methods; ``filter_books`` can be overridden to
+    match and rank in the database instead of through a list of ids.
+    """
+
+    def index_book(self, book):
+        raise NotImplementedError('subclasses of BaseSearchBackend must provide an index_book() method')
+
+    def index_books(self, books):
+        """Index (or reindex) many books at once, e.g. after a bulk import."""
+        for book in books:
+            self.index_book(book)
+
+    def remove_book(self, book_id):
+        raise NotImplementedError('subclasses of BaseSearchBackend must provide a remove_book() method')
+
+    def rebuild(self, books, batch_size=1000):
+        """Rebuild the index from ``books``, returning the number indexed."""
+        raise NotImplementedError('subclasses of BaseSearchBackend must provide a rebuild() method')
+
+    def search(self, query, limit=None):
+        raise NotImplementedError('subclasses of BaseSearchBackend must provide a search() method')
+
+    def filter_books(self, books, query):
+        """
+        Narrow the ``books`` queryset to the matches for ``query``, annotated
+        with their ``search_rank`` (higher is better). This default goes
+        through ``search`` and so only sees its top results.
+        """
+        ranked = self.search(query)
+        if not ranked:
+            return books.none()
+        return books.filter(pk__in=[book_id for book_id, score in ranked]).annotate(search_rank=models.Case(
+            *[models.When(pk=book_id, then=models.Value(score)) for book_id, score in ranked],
+            output_field=models.FloatField(),
+        ))
@@ -0,0 +1,150 @@
+import math
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Avg, Case, Count, F, FloatField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from books.models import SearchDocument, SearchPosting
+
+from ..analysis import analyze, term_frequencies
+from .base import BaseSearchBackend
+
+# Cap on search() results; filter_books() is not limited
+MAX_RESULTS = getattr(settings, 'BOOKS_SEARCH_MAX_RESULTS', 500)
+STATS_CACHE_TIMEOUT = getattr(settings, 'BOOKS_SEARCH_STATS_CACHE_TIMEOUT', 300)
+STATS_CACHE_KEY = 'books:search:stats'
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+
+class DatabaseSearchBackend(BaseSearchBackend):
+    """
+    Inverted index stored in the SearchPosting/SearchDocument tables and
+    ranked with BM25. Works on any database Django supports; every lookup
+    goes through the (term, book) unique index.
+    """
+
+    def index_book(self, book):
+        frequencies, length = term_frequencies(book)
+        with transaction.atomic():
+            SearchPosting.objects.filter(book_id=book.pk).delete()
+            SearchPosting.objects.bulk_create([
+                SearchPosting(term=term, book_id=book.pk, frequency=frequency)
+                for term, frequency in frequencies.items()
+            ])
+            SearchDocument.objects.update_or_create(book_id=book.pk, defaults={'length': length})
+
+    def index_books(self, books):
+        documents = []
+        postings = []
+        for book in books:
+            frequencies, length = term_frequencies(book)
+            documents.append(SearchDocument(book_id=book.pk, length=length))
+            postings.extend(
+                SearchPosting(term=term, book_id=book.pk, frequency=frequency)
+                for term, frequency in frequencies.items()
+            )
+        book_ids = [document.book_id for document in documents]
+        with transaction.atomic():
+            SearchPosting.objects.filter(book_id__in=book_ids).delete()
+            SearchDocument.objects.filter(book_id__in=book_ids).delete()
+            SearchDocument.objects.bulk_create(documents)
+            SearchPosting.objects.bulk_create(postings, batch_size=1000)
+
+    def remove_book(self, book_id):
+        SearchPosting.objects.filter(book_id=book_id).delete()
+        SearchDocument.objects.filter(book_id=book_id).delete()
+
+    def rebuild(self, books, batch_size=1000):
+        count = 0
+        with transaction.atomic():
+            SearchPosting.objects.all().delete()
+            SearchDocument.objects.all().delete()
+            documents = []
+            postings = []
+            for book in books.only('title', 'author', 'description').iterator(chunk_size=batch_size):
+                frequencies, length = term_frequencies(book)
+                documents.append(SearchDocument(book_id=book.pk, length=length))
+                postings.extend(
+                    SearchPosting(term=term, book_id=book.pk, frequency=frequency)
+                    for term, frequency in frequencies.items()
+                )
+                count += 1
+                if len(documents) >= batch_size:
+                    SearchDocument.objects.bulk_create(documents)
+                    SearchPosting.objects.bulk_create(postings, batch_size=batch_size)
+                    documents, postings = [], []
+            SearchDocument.objects.bulk_create(documents)
+            SearchPosting.objects.bulk_create(postings, batch_size=batch_size)
+        cache.delete(STATS_CACHE_KEY)
+        return count
+
+    def corpus_stats(self):
+        """
+        Number of indexed books and their average length, for BM25. Cached:
+        they drift slowly as books are indexed, and a rebuild resets them.
+        """
+        stats = cache.get(STATS_CACHE_KEY)
+        if stats is None:
+            stats = SearchDocument.objects.aggregate(total=Count('pk'), average_length=Avg('length'))
+            cache.set(STATS_CACHE_KEY, stats, STATS_CACHE_TIMEOUT)
+        return stats['total'], stats['average_length'] or 1
+
+    def _scores(self, query):
+        """
+        SearchPosting rows grouped by book with a BM25 ``score``, limited to
+        books matching every query term, or None if nothing can match.
+        """
+        terms = set(analyze(query))
+        if not terms:
+            return None
+        total, average_length = self.corpus_stats()
+
+        document_frequencies = dict(
+            SearchPosting.objects.filter(term__in=terms)
+            .values_list('term')
+            .annotate(count=Count('id'))
+            .order_by()
+        )
+        # Every query term has to match, as with the old icontains filter
+        if len(document_frequencies) < len(terms):
+            return None
+        idf = Case(
+            *[
+                When(term=term, then=Value(math.log(1 + (total - count + 0.5) / (count + 0.5))))
+                for term, count in document_frequencies.items()
+            ],
+            output_field=FloatField(),
+        )
+        length = Coalesce('book__search_document__length', 0)
+        norm = Value(K1 * (1 - B)) + length * Value(K1 * B / average_length)
+        term_score = idf * F('frequency') * Value(K1 + 1) / (F('frequency') + norm)
+        return (
+            SearchPosting.objects.filter(term__in=terms)
+            .values('book_id')
+            .annotate(score=Sum(term_score, output_field=FloatField()), matched=Count('id'))
+            .filter(matched=len(terms))
+        )
+
+    def search(self, query, limit=None):
+        scores = self._scores(query)
+        if scores is None:
+            return []
+        ranked = scores.order_by('-score', 'book_id').values_list('book_id', 'score')
+        return list(ranked[:limit or MAX_RESULTS])
+
+    def filter_books(self, books, query):
+        # Matching and scoring stay in SQL, so every match is kept. The
+        # search_rank subquery is only evaluated for the rows returned, except
+        # under sort=relevance, where ordering by it scores every match.
+        scores = self._scores(query)
+        if scores is None:
+            return books.none()
+        return books.filter(pk__in=scores.values('book_id')).annotate(search_rank=Subquery(
+            scores.filter(book_id=OuterRef('pk')).values('score')[:1],
+            output_field=FloatField(),
+        ))
@@ -0,0 +1,182 @@
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from transactions.models import Transaction, Wishlist
+
+from .autocomplete import loaded_index as loaded_autocomplete_index, refresh_books as refresh_autocomplete
+from .book_cache import book_cache
+from .metrics import REVIEW_WRITES
+from .models import Book, Category, Review
+from .reviews import bump_review_version
+from .search import get_backend
+from .versions import bump_version
+from .wishlists import WishlistEntry, invalidate as invalidate_wishlist
+
+SEARCH_FIELDS = {'title', 'author', 'description'}
+# Changing these moves the 'ratings' version rather than 'catalog': the
+# book list shows and sorts by them, the home page and facets do not.
+RATING_FIELDS = frozenset({
+    'rating', 'total_reviews', 'rating_sum', 'rating_count', *Book.HISTOGRAM_FIELDS.values(),
+})
+# Only shown on the book's own page
+STOCK_FIELDS = frozenset({'quantity', 'updated_at'})
+INVALIDATE_BATCH_SIZE = 500
+
+# Sent with the affected ``instance`` after Book rows are changed through
+# queryset.update(), which does not send post_save, and the changed
+# ``fields`` (None when not known).
+book_updated = Signal()
+
+
+# Sent with ``book_ids`` and ``fields`` after many Book rows are changed in
+# bulk, so receivers can handle them together.
+books_updated = Signal()
+
+
+def notify_book_updated(book, fields=None):
+    # Wait for the commit so readers cannot re-cache the old row
+    transaction.on_commit(lambda: book_updated.send(sender=Book, instance=book, fields=fields))
+
+
+def notify_books_updated(book_ids, fields=None):
+    book_ids = list(book_ids)
+    if book_ids:
+        transaction.on_commit(lambda: books_updated.send(sender=Book, book_ids=book_ids, fields=fields))
+
+
+def bump_catalog_versions(fields=None):
+    """Bump the versions of the catalog pages that show any of ``fields``."""
+    if fields is None:
+        bump_version('catalog')
+        bump_version('ratings')
+        return
+    fields = set(fields) - STOCK_FIELDS
+    if fields & RATING_FIELDS:
+        bump_version('ratings')
+    if fields - RATING_FIELDS:
+        bump_version('catalog')
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+@receiver(book_updated, sender=Book)
+def book_changed(sender, instance, update_fields=None, fields=None, **kwargs):
+    bump_catalog_versions(fields if fields is not None else update_fields)
+    book_cache.invalidate(instance.slug)
+
+
+@receiver(books_updated, sender=Book)
+def books_changed(sender, book_ids, fields=None, **kwargs):
+    bump_catalog_versions(fields)
+    for start in range(0, len(book_ids), INVALIDATE_BATCH_SIZE):
+        batch = book_ids[start:start + INVALIDATE_BATCH_SIZE]
+        book_cache.invalidate_many(Book.objects.filter(pk__in=batch).values_list('slug', flat=True))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, instance, **kwargs):
+    bump_version('catalog')
+
+
+# The index is only changed once the write commits, so a rolled-back save
+# never shows up in suggestions
+@receiver(post_save, sender=Book)
+def complete_book(sender, instance, **kwargs):
+    index = loaded_autocomplete_index()
+    if index is not None:
+        transaction.on_commit(lambda: index.update_book(instance))
+
+
+@receiver(post_delete, sender=Book)
+def uncomplete_book(sender, instance, **kwargs):
+    index = loaded_autocomplete_index()
+    if index is not None:
+        pk = instance.pk
+        transaction.on_commit(lambda: index.remove_book(pk))
+
+
+# Ratings, stock and covers change through update(); re-read the rows
+@receiver(book_updated, sender=Book)
+def recomplete_book(sender, instance, **kwargs):
+    index = loaded_autocomplete_index()
+    if index is not None:
+        refresh_autocomplete(index, [instance.pk])
+
+
+@receiver(books_updated, sender=Book)
+def recomplete_books(sender, book_ids, **kwargs):
+    index = loaded_autocomplete_index()
+    if index is not None:
+        refresh_autocomplete(index, book_ids)
+
+
+@receiver(post_save, sender=Book)
+def index_book(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not SEARCH_FIELDS.intersection(update_fields):
+        return
+    get_backend().index_book(instance)
+
+
+@receiver(post_delete, sender=Book)
+def unindex_book(sender, instance, **kwargs):
+    get_backend().remove_book(instance.pk)
+
+
+def _deletes_book(origin):
+    # Reviews are reached by a cascade either through their author or
+    # through their book, from a Book or its Category.
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return model in (Book, Category)
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, origin=None, **kwargs):
+    from .ratings import apply_review_delta
+
+    REVIEW_WRITES.inc(action='delete')
+    if _deletes_book(origin):
+        # The book is deleted along with its reviews; nothing to update
+        return
+    apply_review_delta(instance.book_id, removed=instance.rating)
+
+
+@receiver(post_save, sender=Transaction)
+@receiver(post_delete, sender=Transaction)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def user_activity_changed(sender, instance, **kwargs):
+    from .dashboard import invalidate_dashboard
+
+    invalidate_dashboard(instance.user_id)
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def review_changed(sender, instance, origin=None, **kwargs):
+    if not _deletes_book(origin):
+        bump_review_version(instance.book_id)
+
+
+@receiver(m2m_changed, sender=WishlistEntry)
+def wishlist_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            invalidate_wishlist(instance.user_id)
+        return
+    # book.wishlist_set.add/remove/clear(): find the owners of the wishlists
+    if action == 'pre_clear':
+        wishlists = WishlistEntry.objects.filter(book_id=instance.pk).values_list('wishlist__user_id', flat=True)
+    elif action in ('post_add', 'post_remove'):
+        wishlists = Wishlist.objects.filter(pk__in=pk_set).values_list('user_id', flat=True)
+    else:
+        return
+    for user_id in wishlists:
+        invalidate_wishlist(user_id)
+
+
+@receiver(post_delete, sender=Wishlist)
+def wishlist_deleted(sender, instance, **kwargs):
+    invalidate_wishlist(instance.user_id)
@@ -0,0 +1,121 @@
+from functools import reduce
+from operator import or_
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils.text import slugify
+
+# Room kept at the end of a truncated slug for a "-<n>" suffix
+SUFFIX_RESERVE = 7
+# Bases looked up per query
+LOOKUP_BATCH_SIZE = 200
+# Picked slugs checked per query
+CONFIRM_BATCH_SIZE = 500
+SAVE_ATTEMPTS = 5
+
+
+def slug_base(text, max_length):
+    base = slugify(text)[:max_length - SUFFIX_RESERVE].strip('-')
+    return base or 'item'
+
+
+class SlugAllocator:
+    """
+    Hands out unique slugs for ``model`` such as ``dune``, ``dune-2``,
+    ``dune-3``. Existing slugs are fetched with one query per
+    LOOKUP_BATCH_SIZE new distinct bases, however many titles collide, and
+    remembered, so a long import asks about each base only once.
+
+    Slugs are only reserved once the rows are written, so two concurrent
+    allocators can still pick the same value; single saves go through
+    save_with_unique_slug(), which retries.
+    """
+
+    def __init__(self, model, field='slug'):
+        self.model = model
+        self.field = field
+        self.max_length = model._meta.get_field(field).max_length
+        self.taken = set()
+        self.looked_up = set()
+        self.next_suffix = {}
+
+    def _look_up(self, bases):
+        bases = sorted(set(bases) - self.looked_up)
+        field = self.field
+        for start in range(0, len(bases), LOOKUP_BATCH_SIZE):
+            chunk = bases[start:start + LOOKUP_BATCH_SIZE]
+            # "base" itself plus the range of "base-..." values; a range
+            # (unlike LIKE 'base-%') can use the slug's unique index on every
+            # backend. '.' is the character right after '-' in byte order,
+            # which linguistic collations do not follow; allocate() confirms
+            # its picks, so this is only a prefetch.
+            query = reduce(or_, (
+                Q(**{field: base}) | Q(**{f'{field}__gte': f'{base}-', f'{field}__lt': f'{base}.'})
+                for base in chunk
+            ))
+            self.taken.update(self.model._default_manager.filter(query).values_list(field, flat=True))
+        self.looked_up.update(bases)
+
+    def _pick(self, bases):
+        taken = set()
+        next_suffix = dict(self.next_suffix)
+        slugs = []
+        for base in bases:
+            if base not in self.taken and base not in taken:
+                slug = base
+            else:
+                suffix = next_suffix.get(base, 2)
+                while f'{base}-{suffix}' in self.taken or f'{base}-{suffix}' in taken:
+                    suffix += 1
+                slug = f'{base}-{suffix}'
+                next_suffix[base] = suffix + 1
+            taken.add(slug)
+            slugs.append(slug)
+        return slugs, next_suffix
+
+    def _existing(self, slugs):
+        existing = set()
+        for start in range(0, len(slugs), CONFIRM_BATCH_SIZE):
+            chunk = slugs[start:start + CONFIRM_BATCH_SIZE]
+            existing.update(
+                self.model._default_manager.filter(**{f'{self.field}__in': chunk})
+                .values_list(self.field, flat=True)
+            )
+        return existing
+
+    def allocate(self, texts):
+        """Return a unique slug for each of ``texts``, in order."""
+        bases = [slug_base(text, self.max_length) for text in texts]
+        self._look_up(bases)
+        while True:
+            slugs, next_suffix = self._pick(bases)
+            # Exact matches do not depend on the collation; anything the
+            # range prefetch missed is remembered and the batch re-picked.
+            existing = self._existing(slugs)
+            if not existing:
+                break
+            self.taken.update(existing)
+        self.taken.update(slugs)
+        self.next_suffix = next_suffix
+        return slugs
+
+
+def allocate_slugs(model, texts, field='slug'):
+    return SlugAllocator(model, field).allocate(texts)
+
+
+def save_with_unique_slug(instance, text, save, *args, field='slug', **kwargs):
+    """
+    Allocate a slug for ``instance`` from ``text`` and call ``save``. If a
+    concurrent insert took the same slug first, allocate again and retry.
+    """
+    model = type(instance)
+    for attempt in range(SAVE_ATTEMPTS):
+        setattr(instance, field, allocate_slugs(model, [text], field=field)[0])
+        try:
+            with transaction.atomic():
+                return save(*args, **kwargs)
+        except IntegrityError:
+            slug_taken = model._default_manager.filter(**{field: getattr(instance, field)}).exists()
+            if not slug_taken or attempt == SAVE_ATTEMPTS - 1:
+                raise
@@ -0,0 +1,33 @@
+from django import template
+from django.utils.html import format_html
+
+from books.covers import cover_srcset, cover_url
+
+register = template.Library()
+
+
+@register.simple_tag
+def book_cover_url(book, variant='card', image_format='jpeg'):
+    """{% book_cover_url book 'thumbnail' 'webp' %}"""
+    return cover_url(book, variant, image_format)
+
+
+@register.simple_tag
+def book_cover(book, variant='card', sizes='', css_class=''):
+    """
+    Render a <picture> offering the WebP variants with a JPEG fallback,
+    e.g. {% book_cover book 'card' sizes='(max-width: 600px) 50vw, 320px' %}.
+    """
+    if not book.cover_hash:
+        return format_html(
+            '<img src="{}" alt="{}" class="{}" loading="lazy">',
+            cover_url(book, variant), book.title, css_class,
+        )
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}" loading="lazy">'
+        '</picture>',
+        cover_srcset(book, 'webp'), sizes, cover_url(book, variant), cover_srcset(book), sizes,
+        book.title, css_class,
+    )
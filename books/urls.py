@@ -6,8 +6,11 @@ app_name = 'books'
 urlpatterns = [
     path('', views.home, name='home'),
     path('books/', views.book_list, name='book_list'),
+    path('books/autocomplete/', views.autocomplete, name='autocomplete'),
+    path('books/export/', views.export_catalog, name='export_catalog'),
     path('dashboard/', views.dashboard, name='dashboard'),
     path('book/<slug:slug>/', views.book_detail, name='book_detail'),
+    path('book/<slug:slug>/reviews/', views.book_reviews, name='book_reviews'),
     path('book/<slug:slug>/borrow/', views.borrow_book, name='borrow_book'),
     path('book/<slug:slug>/rent/', views.rent_book, name='rent_book'),
     path('book/<slug:slug>/purchase/', views.purchase_book, name='purchase_book'),
@@ -16,5 +19,6 @@ urlpatterns = [
     path('wishlist/', views.wishlist_view, name='wishlist'),
     path('wishlist/add/<slug:slug>/', views.add_to_wishlist, name='add_to_wishlist'),
     path('wishlist/remove/<slug:slug>/', views.remove_from_wishlist, name='remove_from_wishlist'),
+    path('metrics/', views.metrics, name='metrics'),
     path('newsletter/subscribe/', views.newsletter_subscribe, name='newsletter_subscribe'),
 ] 
\ No newline at end of file
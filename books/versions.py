@@ -0,0 +1,30 @@
+import time
+
+from django.core.cache import cache
+
+VERSION_KEY = 'books:version:{}'
+
+
+def _initial_version():
+    # Seed from the clock so an evicted counter never hands out a version
+    # that was already used for cached data.
+    return int(time.time() * 1000)
+
+
+def get_version(name):
+    key = VERSION_KEY.format(name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _initial_version(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(name):
+    key = VERSION_KEY.format(name)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = _initial_version()
+        cache.set(key, version, None)
+        return version
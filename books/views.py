@@ -1,69 +1,87 @@
-from django.shortcuts import render, get_object_or_404, redirect
-from django.contrib.auth.decorators import login_required
+from django.shortcuts import render, redirect
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+from django.utils.crypto import constant_time_compare
+from django.contrib.auth.decorators import login_required, permission_required
 from django.contrib import messages
-from django.db.models import Q
 from django.core.paginator import Paginator
-from .models import Book, Category, Review
-from transactions.models import Transaction, Wishlist
+from .models import Book, BookQuerySet, Category
+from transactions.models import Wishlist
 from .forms import ReviewForm
+from .autocomplete import DEFAULT_COMPLETIONS, get_index as get_autocomplete_index
+from .book_cache import get_book_or_404
+from .conditional import book_detail_etag, book_list_etag, conditional_page, home_etag
+from .dashboard import get_dashboard
+from .export import FORMATS, export_queryset, iter_export, parse_since
+from .facets import annotate_category_counts, get_facet_counts
+from .featured import get_home_sections
+from .inventory import NoActiveLoan, OutOfStock, release_copy, reserve_copy
+from .metrics import REGISTRY
 from django.utils import timezone
 from django.views.decorators.http import require_POST
+from django.conf import settings
+from .pagination import KeysetPaginator
+from .reviews import get_review_page, serialize_review
+from .wishlists import add_wishlist_book, is_wishlisted, remove_wishlist_book, wishlisted_ids
 
+BOOKS_PER_PAGE = 12
+
+# 'keyset' serves book_list with opaque cursors instead of page numbers;
+# a request carrying ?cursor= always uses keyset pagination.
+CATALOG_PAGINATION = getattr(settings, 'BOOKS_CATALOG_PAGINATION', 'offset')
+KEYSET_SORTS = ('newest', 'rating', 'title', 'popular')
+
+@conditional_page(home_etag)
 def home(request):
-    featured_books = Book.objects.filter(availability_status='available')[:8]
-    categories = Category.objects.all()
-    return render(request, 'home.html', {
-        'featured_books': featured_books,
-        'categories': categories,
-    })
+    return render(request, 'home.html', get_home_sections())
 
+@conditional_page(book_list_etag)
 def book_list(request):
-    books = Book.objects.all()
-    categories = Category.objects.all()
-    
     # Get filter parameters
     category = request.GET.get('category')
     search = request.GET.get('search')
     availability = request.GET.get('availability')
-    sort = request.GET.get('sort', 'newest')
+    sort = request.GET.get('sort', 'relevance' if search else 'newest')
     
     # Apply filters
-    if category:
-        books = books.filter(category__slug=category)
-    if search:
-        books = books.filter(
-            Q(title__icontains=search) |
-            Q(author__icontains=search) |
-            Q(description__icontains=search)
-        )
-    if availability:
-        if availability == 'available':
-            books = books.filter(availability_status='available')
-        elif availability == 'borrowed':
-            books = books.filter(availability_status__in=['borrowed', 'rented'])
+    books = Book.objects.filter_catalog(
+        category=category,
+        search=search,
+        availability=availability,
+    )
     
-    # Apply sorting
-    if sort == 'newest':
-        books = books.order_by('-created_at')
-    elif sort == 'rating':
-        books = books.order_by('-rating')
-    elif sort == 'title':
-        books = books.order_by('title')
-    elif sort == 'popular':
-        books = books.order_by('-total_reviews')
+    # Add book count to categories from a single grouped query
+    facets = get_facet_counts(books, {
+        'category': category,
+        'search': search,
+        'availability': availability,
+    })
+    categories = annotate_category_counts(Category.objects.all(), facets)
     
-    # Add book count to categories
-    for category in categories:
-        category.book_count = Book.objects.filter(category=category).count()
+    # Apply sorting; the cards show each book's category
+    books = books.sort_catalog(sort).select_related('category')
     
     # Pagination
-    paginator = Paginator(books, 12)
-    page = request.GET.get('page')
-    books = paginator.get_page(page)
+    cursor = request.GET.get('cursor')
+    keyset = sort in KEYSET_SORTS and (cursor is not None or CATALOG_PAGINATION == 'keyset')
+    if keyset:
+        paginator = KeysetPaginator(
+            books,
+            BookQuerySet.SORT_ORDERINGS[sort],
+            BOOKS_PER_PAGE,
+            count=facets['total'],
+        )
+        books = paginator.get_page(cursor)
+    else:
+        paginator = Paginator(books, BOOKS_PER_PAGE)
+        page = request.GET.get('page')
+        books = paginator.get_page(page)
     
     context = {
         'books': books,
         'categories': categories,
+        'facets': facets,
+        'pagination': 'keyset' if keyset else 'offset',
+        'wishlisted_ids': wishlisted_ids(request.user, books),
         'selected_categories': [category] if category else [],
         'availability': availability,
         'sort': sort,
@@ -74,162 +92,107 @@ def book_list(request):
 
 @login_required
 def dashboard(request):
-    # Get active transactions (completed borrow/rent transactions)
-    active_transactions = Transaction.objects.filter(
-        user=request.user,
-        status='completed',
-        transaction_type__in=['borrow', 'rent']
-    ).order_by('-created_at')
-
-    # Get borrowed books (books with active transactions)
-    borrowed_books = Book.objects.filter(
-        transactions__user=request.user,
-        transactions__status='completed',
-        transactions__transaction_type__in=['borrow', 'rent']
-    ).distinct()
-
-    # Get total number of books borrowed (including returned ones)
-    total_borrowed = Transaction.objects.filter(
-        user=request.user,
-        transaction_type__in=['borrow', 'rent']
-    ).count()
-
-    # Get wishlist books
-    wishlist = Wishlist.objects.get_or_create(user=request.user)[0]
-    wishlist_books = wishlist.books.all()
-
-    # Get recent reviews
-    recent_reviews = Review.objects.filter(user=request.user).order_by('-created_at')[:5]
-
-    context = {
-        'active_transactions': active_transactions,
-        'borrowed_books': borrowed_books,
-        'total_borrowed': total_borrowed,
-        'wishlist_books': wishlist_books,
-        'recent_reviews': recent_reviews,
-    }
-    return render(request, 'books/dashboard.html', context)
+    return render(request, 'books/dashboard.html', get_dashboard(request.user))
 
+@conditional_page(book_detail_etag)
 def book_detail(request, slug):
-    book = get_object_or_404(Book, slug=slug)
-    reviews = book.reviews.all().order_by('-created_at')
-    is_wishlisted = False
-    
-    if request.user.is_authenticated:
-        wishlist = Wishlist.objects.get_or_create(user=request.user)[0]
-        is_wishlisted = book in wishlist.books.all()
+    book = get_book_or_404(slug, getattr(request, 'book_updated_at', None))
+    review_sort = request.GET.get('review_sort', 'newest')
+    reviews = get_review_page(book, review_sort, request.GET.get('review_cursor'))
     
     return render(request, 'books/book_detail.html', {
         'book': book,
         'reviews': reviews,
-        'is_wishlisted': is_wishlisted,
+        'review_sort': review_sort,
+        'is_wishlisted': is_wishlisted(request.user, book),
+    })
+
+def book_reviews(request, slug):
+    """JSON page of a book's reviews for "load more"."""
+    book = get_book_or_404(slug)
+    reviews = get_review_page(book, request.GET.get('sort', 'newest'), request.GET.get('cursor'))
+    return JsonResponse({
+        'reviews': [serialize_review(review) for review in reviews],
+        'next_cursor': reviews.next_cursor,
+        'total': reviews.total_count,
+        'rating_histogram': book.rating_histogram,
     })
 
 @login_required
 def borrow_book(request, slug):
-    book = get_object_or_404(Book, slug=slug)
+    book = get_book_or_404(slug)
     if book.availability_status != 'available' or book.quantity <= 0:
         messages.error(request, 'This book is not available for borrowing.')
         return redirect('books:book_detail', slug=book.slug)
     
-    transaction = Transaction.objects.create(
-        transaction_type='borrow',
-        book=book,
-        user=request.user,
-        amount=0,
-        due_date=timezone.now() + timezone.timedelta(days=14),
-        status='completed'
-    )
-    
-    # Update book availability and quantity
-    book.quantity -= 1
-    if book.quantity == 0:
-        book.availability_status = 'borrowed'
-    book.save()
+    try:
+        reserve_copy(
+            book,
+            'borrow',
+            request.user,
+            amount=0,
+            due_date=timezone.now() + timezone.timedelta(days=14),
+        )
+    except OutOfStock:
+        messages.error(request, 'This book is not available for borrowing.')
+        return redirect('books:book_detail', slug=book.slug)
     
     messages.success(request, f'Successfully borrowed {book.title}.')
     return redirect('books:book_detail', slug=book.slug)
 
 @login_required
 def rent_book(request, slug):
-    book = get_object_or_404(Book, slug=slug)
+    book = get_book_or_404(slug)
     if book.availability_status != 'available' or not book.rental_price or book.quantity <= 0:
         messages.error(request, 'This book is not available for renting.')
         return redirect('books:book_detail', slug=book.slug)
     
-    transaction = Transaction.objects.create(
-        transaction_type='rent',
-        book=book,
-        user=request.user,
-        amount=book.rental_price,
-        due_date=timezone.now() + timezone.timedelta(days=7),
-        status='completed'
-    )
-    
-    # Update book availability and quantity
-    book.quantity -= 1
-    if book.quantity == 0:
-        book.availability_status = 'rented'
-    book.save()
+    try:
+        reserve_copy(
+            book,
+            'rent',
+            request.user,
+            amount=book.rental_price,
+            due_date=timezone.now() + timezone.timedelta(days=7),
+        )
+    except OutOfStock:
+        messages.error(request, 'This book is not available for renting.')
+        return redirect('books:book_detail', slug=book.slug)
     
     messages.success(request, f'Successfully rented {book.title}.')
     return redirect('books:book_detail', slug=book.slug)
 
 @login_required
 def purchase_book(request, slug):
-    book = get_object_or_404(Book, slug=slug)
+    book = get_book_or_404(slug)
     if book.availability_status != 'available' or book.quantity <= 0:
         messages.error(request, 'This book is not available for purchase.')
         return redirect('books:book_detail', slug=book.slug)
     
-    transaction = Transaction.objects.create(
-        transaction_type='purchase',
-        book=book,
-        user=request.user,
-        amount=book.price,
-        status='completed'
-    )
-    
-    # Update book availability and quantity
-    book.quantity -= 1
-    if book.quantity == 0:
-        book.availability_status = 'sold'
-    book.save()
+    try:
+        reserve_copy(book, 'purchase', request.user, amount=book.price)
+    except OutOfStock:
+        messages.error(request, 'This book is not available for purchase.')
+        return redirect('books:book_detail', slug=book.slug)
     
     messages.success(request, f'Successfully purchased {book.title}.')
     return redirect('books:book_detail', slug=book.slug)
 
 @login_required
 def return_book(request, slug):
-    book = get_object_or_404(Book, slug=slug)
-    transaction = Transaction.objects.filter(
-        book=book,
-        user=request.user,
-        transaction_type__in=['borrow', 'rent'],
-        status='completed'
-    ).first()
-    
-    if not transaction:
+    book = get_book_or_404(slug)
+    try:
+        release_copy(book, request.user)
+    except NoActiveLoan:
         messages.error(request, 'No active transaction found for this book.')
         return redirect('books:book_detail', slug=book.slug)
     
-    transaction.transaction_type = 'return'
-    transaction.status = 'completed'
-    transaction.return_date = timezone.now()
-    transaction.save()
-    
-    # Update book availability and quantity
-    book.quantity += 1
-    if book.quantity > 0:
-        book.availability_status = 'available'
-    book.save()
-    
     messages.success(request, f'Successfully returned {book.title}.')
     return redirect('books:book_detail', slug=book.slug)
 
 @login_required
 def add_review(request, slug):
-    book = get_object_or_404(Book, slug=slug)
+    book = get_book_or_404(slug)
     if request.method == 'POST':
         form = ReviewForm(request.POST)
         if form.is_valid():
@@ -249,37 +212,84 @@ def add_review(request, slug):
 
 @login_required
 def wishlist_view(request):
-    wishlist = Wishlist.objects.get_or_create(user=request.user)[0]
+    # Reading the wishlist never creates one
+    wishlist = Wishlist.objects.filter(user=request.user).first()
+    wishlist_books = wishlist.books.select_related('category') if wishlist else Book.objects.none()
     return render(request, 'books/wishlist.html', {
         'wishlist': wishlist,
+        'wishlist_books': wishlist_books,
     })
 
 @login_required
 def add_to_wishlist(request, slug):
-    book = get_object_or_404(Book, slug=slug)
-    wishlist, created = Wishlist.objects.get_or_create(user=request.user)
+    book = get_book_or_404(slug)
     
-    if book in wishlist.books.all():
-        messages.info(request, f'{book.title} is already in your wishlist.')
-    else:
-        wishlist.books.add(book)
+    if add_wishlist_book(request.user, book):
         messages.success(request, f'{book.title} added to your wishlist.')
+    else:
+        messages.info(request, f'{book.title} is already in your wishlist.')
     
     return redirect('books:book_detail', slug=book.slug)
 
 @login_required
 def remove_from_wishlist(request, slug):
-    book = get_object_or_404(Book, slug=slug)
-    wishlist = Wishlist.objects.filter(user=request.user).first()
+    book = get_book_or_404(slug)
     
-    if wishlist and book in wishlist.books.all():
-        wishlist.books.remove(book)
+    if remove_wishlist_book(request.user, book):
         messages.success(request, f'{book.title} removed from your wishlist.')
     else:
         messages.info(request, f'{book.title} is not in your wishlist.')
     
     return redirect('books:book_detail', slug=book.slug)
 
+@login_required
+@permission_required('books.view_book', raise_exception=True)
+def export_catalog(request):
+    # Full inventory: staff with the view permission only, not customers
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in FORMATS:
+        return HttpResponseBadRequest(f'Unknown format {fmt!r}')
+    compress = request.GET.get('gzip') in ('1', 'true')
+
+    exported_at = timezone.now()
+    updated_since = request.GET.get('updated_since')
+    try:
+        updated_since = parse_since(updated_since) if updated_since else None
+        books = export_queryset(
+            category=request.GET.get('category'),
+            availability=request.GET.get('availability'),
+            updated_since=updated_since,
+        )
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    filename = f'catalog.{fmt}.gz' if compress else f'catalog.{fmt}'
+    response = StreamingHttpResponse(
+        iter_export(books, fmt, compress=compress),
+        content_type='application/gzip' if compress else f'{FORMATS[fmt]}; charset=utf-8',
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    # Pass back as updated_since for the next incremental pull
+    response['X-Exported-At'] = exported_at.isoformat()
+    return response
+
+def autocomplete(request):
+    try:
+        limit = int(request.GET.get('limit', DEFAULT_COMPLETIONS))
+    except ValueError:
+        return HttpResponseBadRequest('limit must be a number')
+    query = request.GET.get('q', '')
+    return JsonResponse({
+        'query': query,
+        'results': get_autocomplete_index().complete(query, max(limit, 1)),
+    })
+
+def metrics(request):
+    # Scrapers authenticate with a bearer token when one is configured
+    token = getattr(settings, 'BOOKS_METRICS_TOKEN', None)
+    if token and not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponseForbidden()
+    return HttpResponse(REGISTRY.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @require_POST
 def newsletter_subscribe(request):
     email = request.POST.get('email')
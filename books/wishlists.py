@@ -0,0 +1,72 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from transactions.models import Wishlist
+
+WISHLIST_CACHE_TIMEOUT = getattr(settings, 'BOOKS_WISHLIST_CACHE_TIMEOUT', 3600)
+
+WishlistEntry = Wishlist.books.through
+
+
+def _cache_key(user_id):
+    return f'books:wishlist:{user_id}'
+
+
+def invalidate(user_id):
+    from .dashboard import invalidate_dashboard
+
+    cache.delete(_cache_key(user_id))
+    invalidate_dashboard(user_id)
+
+
+def wishlist_book_ids(user):
+    """
+    Frozen set of the ids of the books on ``user``'s wishlist, read from
+    the wishlist table once and then cached until the wishlist changes.
+    """
+    if not user.is_authenticated:
+        return frozenset()
+    key = _cache_key(user.pk)
+    book_ids = cache.get(key)
+    if book_ids is None:
+        book_ids = frozenset(
+            WishlistEntry.objects.filter(wishlist__user=user).values_list('book_id', flat=True)
+        )
+        cache.set(key, book_ids, WISHLIST_CACHE_TIMEOUT)
+    return book_ids
+
+
+def is_wishlisted(user, book):
+    """Whether ``book`` is on ``user``'s wishlist, without loading the wishlist."""
+    if not user.is_authenticated:
+        return False
+    book_ids = cache.get(_cache_key(user.pk))
+    if book_ids is not None:
+        return book.pk in book_ids
+    return WishlistEntry.objects.filter(wishlist__user=user, book_id=book.pk).exists()
+
+
+def wishlisted_ids(user, books):
+    """The ids among ``books`` (e.g. a catalog page) that are on ``user``'s wishlist."""
+    book_ids = wishlist_book_ids(user)
+    if not book_ids:
+        return set()
+    return {book.pk for book in books if book.pk in book_ids}
+
+
+def add_wishlist_book(user, book):
+    """Add ``book`` to ``user``'s wishlist, creating it if needed. Returns False if it was already there."""
+    if is_wishlisted(user, book):
+        return False
+    wishlist, created = Wishlist.objects.get_or_create(user=user)
+    # add() skips books already present and sends m2m_changed
+    wishlist.books.add(book)
+    return True
+
+
+def remove_wishlist_book(user, book):
+    """Remove ``book`` from ``user``'s wishlist. Returns False if it wasn't there."""
+    deleted, _ = WishlistEntry.objects.filter(wishlist__user=user, book_id=book.pk).delete()
+    # A queryset delete sends no m2m_changed
+    invalidate(user.pk)
+    return bool(deleted)